@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pdf2image.exceptions import PDFInfoNotInstalledError
+
+from sudoku import batch
+from sudoku.board import Board
+from sudoku.difficulty import difficulties
+from sudoku.generator import Generator, generate
+from sudoku.pdf import SudokuPDF
+from sudoku.solver import Solver
+from utils import FLATTEN_BACKENDS, flatten_pdf
+
+CORPUS_FILE = 'benchmarks/puzzles.txt'
+RESULTS_FILE = 'benchmarks/results.json'
+BASELINE_FILE = 'benchmarks/baseline.json'
+
+# modules only rendering, flattening and the batch checks need; importing
+# main.py must not load any of them
+HEAVY_MODULES = ('fpdf', 'numpy', 'PIL', 'pdf2image', 'pypdf')
+
+
+# times fn over a few rounds and keeps the fastest, then runs it once more
+# under tracemalloc for its peak memory. fn returns the number of items
+# (puzzles, pages) it processed
+def measure(name, unit, fn, rounds=3):
+    seconds = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        count = fn()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'count': count,
+        'seconds': round(seconds, 6),
+        'throughput': round(count / seconds, 3) if seconds else None,
+        'unit': unit,
+        'peak_bytes': peak,
+    }
+
+
+# reads the fixed puzzle corpus, grouped by its hardness label
+def load_corpus(path=CORPUS_FILE):
+    corpus = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                label, puzzle = line.split()
+                corpus.setdefault(label, []).append([0 if c == '.' else int(c) for c in puzzle])
+    return corpus
+
+
+def bench_solver(corpus, repeat):
+    results = []
+    for label, puzzles in corpus.items():
+        boards = [Board(p) for p in puzzles]
+
+        def run():
+            for _ in range(repeat):
+                for board in boards:
+                    Solver(board).solve()
+            return repeat * len(boards)
+
+        results.append(measure(f'solver:{label}', 'puzzles/sec', run))
+    return results
+
+
+def bench_generator(count):
+    results = []
+    for difficulty in difficulties:
+        def run():
+            rng = random.Random(0)
+            for _ in range(count):
+                Generator(difficulty, rng)
+            return count
+
+        results.append(measure(f'generator:{difficulty.name.lower()}', 'puzzles/sec', run))
+
+    # low-clue puzzles, blanked down to an exact clue count
+    def run_clues():
+        rng = random.Random(0)
+        for _ in range(count):
+            Generator(difficulties[-1], rng, clues=(24, 24))
+        return count
+
+    results.append(measure('generator:clues-24', 'puzzles/sec', run_clues))
+    return results
+
+
+# checks every generated puzzle/solution pair at once, repeated to a
+# bank-sized batch
+def bench_batch(generated, repeat):
+    pairs = [pair for batch_ in generated for pair in batch_]
+    puzzles = batch.to_array([board for board, _ in pairs] * repeat)
+    solutions = batch.to_array([solution for _, solution in pairs] * repeat)
+    return [
+        measure('batch:validate', 'boards/sec', lambda: len(batch.validate(solutions))),
+        measure('batch:check', 'pairs/sec', lambda: len(batch.check_solutions(puzzles, solutions))),
+    ]
+
+
+# builds a PDF with only puzzle and solution pages
+def render(boards, solutions):
+    pdf = SudokuPDF(unit='in', format=(6, 9))
+    pdf.setup_fonts()
+    if boards is not None:
+        pdf.draw_boards(boards)
+    if solutions is not None:
+        pdf.draw_solutions(solutions)
+    return pdf
+
+
+def bench_render(generated):
+    boards = [[board for board, _ in batch] for batch in generated]
+    solutions = [solution for batch in generated for _, solution in batch]
+    return [
+        measure('render:boards', 'pages/sec', lambda: render(boards, None).page),
+        measure('render:solutions', 'grids/sec', lambda: render(None, solutions) and len(solutions)),
+    ]
+
+
+def bench_flatten(generated, pages):
+    solutions = [solution for batch in generated for _, solution in batch][:pages - 1]
+    with tempfile.TemporaryDirectory() as folder:
+        input_path = os.path.join(folder, 'input.pdf')
+        output_path = os.path.join(folder, 'output.pdf')
+        pdf = render(None, solutions)
+        pdf.output(input_path)
+
+        results = []
+        for backend in FLATTEN_BACKENDS:
+            def run():
+                flatten_pdf(input_path, output_path, backend=backend)
+                return pdf.page
+
+            try:
+                results.append(measure(f'flatten:{backend}', 'pages/sec', run))
+            except PDFInfoNotInstalledError:
+                print(f'Skipping flatten:{backend}: poppler is not installed.', file=sys.stderr)
+        return results
+
+
+# times a fresh interpreter importing main.py, and lists any heavy modules
+# that import pulled in
+def bench_startup():
+    code = f'import sys, main; print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    loaded = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+
+    def run():
+        subprocess.run([sys.executable, '-c', 'import main'], check=True)
+        return 1
+
+    return [measure('startup', 'starts/sec', run)], loaded
+
+
+# compares throughput against the baseline, returns the names that regressed
+def compare(results, baseline, tolerance):
+    regressions = []
+    previous = {r['name']: r for r in baseline}
+    print(f'{"benchmark":<22} {"throughput":>12} {"baseline":>12} {"ratio":>7} {"peak MB":>9}  unit')
+    for r in results:
+        before = previous.get(r['name'], {}).get('throughput')
+        ratio = r['throughput'] / before if before and r['throughput'] else None
+        if ratio is not None and ratio < 1 - tolerance:
+            regressions.append(r['name'])
+        print(
+            f'{r["name"]:<22} {r["throughput"] or 0:>12.1f} {before or 0:>12.1f} '
+            f'{ratio or 0:>7.2f} {r["peak_bytes"] / 2 ** 20:>9.2f}  {r["unit"]}'
+            f'{"  REGRESSION" if r["name"] in regressions else ""}'
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks startup, the solver, generator, batch checks, rendering and flattening.')
+    parser.add_argument('--count', type=int, default=20, help='Puzzles per difficulty for generator/render benchmarks.')
+    parser.add_argument('--repeat', type=int, default=20, help='Times each corpus puzzle is solved.')
+    parser.add_argument('--pages', type=int, default=10, help='Pages in the PDF used to benchmark flattening.')
+    parser.add_argument('--output', default=RESULTS_FILE, help='Where to write the JSON results.')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='The JSON results to compare against.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed throughput drop before failing.')
+    parser.add_argument('--import-budget', type=float, default=0.25,
+                        help='Seconds a fresh interpreter may take to import main.py.')
+    args = parser.parse_args()
+
+    startup, loaded = bench_startup()
+
+    generated = generate([(d, args.count) for d in difficulties], seed=0)
+    results = (
+        startup
+        + bench_solver(load_corpus(), args.repeat)
+        + bench_generator(args.count)
+        + bench_batch(generated, args.repeat)
+        + bench_render(generated)
+        + bench_flatten(generated, args.pages)
+    )
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if loaded:
+        regressions.append(f'startup (imports {", ".join(loaded)})')
+    if startup[0]['seconds'] > args.import_budget:
+        regressions.append(f'startup ({startup[0]["seconds"]:.3f}s, over the {args.import_budget}s budget)')
+    if regressions:
+        sys.exit(f'Throughput regressed for: {", ".join(regressions)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,9 @@ class ConfigurationError(Exception):
 
 class ValidationError(Exception):
     pass
+
+class BankExhaustedError(Exception):
+    pass
+
+class FontNotEmbeddedError(Exception):
+    pass
@@ -1,16 +1,191 @@
 import argparse
+import cProfile
+import random
+import sys
+from itertools import islice
 
-from sudoku.pdf import SudokuPDF
+# Only light modules are imported up front. Rendering, flattening and the
+# NumPy checks pull in fpdf, pdf2image/Pillow, pypdf and numpy, so those are
+# imported by the commands that need them, inside run()
+from sudoku import stats
+from sudoku.bank import BANK_FILE
 from sudoku.difficulty import difficulties
+from sudoku.grid import MIN_CLUES, SYMMETRIES
+from utils import FLATTEN_BACKENDS
+
+
+# adds the options selecting how many puzzles of each difficulty to make,
+# and how to make them
+def add_common_arguments(parser):
+    parser.add_argument('--count', type=int, nargs='?', help='The total number of puzzles to include.')
+    for d in difficulties:
+        name = d.name.lower()
+        parser.add_argument(f'--{name}', type=int, default=0, help=f'The number of {name} puzzles to include.')
+    parser.add_argument('--workers', type=int, default=1, help='The number of processes used to generate puzzles.')
+    parser.add_argument('--unique', action='store_true',
+                        help='Reject puzzles equivalent to another one in the same run.')
+    parser.add_argument('--seed', type=int,
+                        help='Build the same puzzles as any other run with this seed (default: a random seed).')
+    add_clue_arguments(parser)
+    parser.add_argument('--profile', action='store_true', help='Print per-difficulty counters and timings when done.')
+    parser.add_argument('--pstats', help='Also write a cProfile dump of the main process to this file.')
+
+
+# adds the options describing the book to build
+def add_book_arguments(parser):
+    parser.add_argument('--from-bank', nargs='?', const=BANK_FILE, default=None,
+                        help=f'Draw the puzzles from a puzzle bank (default: {BANK_FILE}) instead of generating them.')
+    parser.add_argument('--trim', type=trim, default=(6, 9), help='The page size in inches (default: 6x9).')
+    parser.add_argument('--inner-margin', type=float, default=.9, help='The gutter-side margin in inches.')
+    parser.add_argument('--outer-margin', type=float, default=.55, help='The outside margin in inches.')
+    parser.add_argument('--puzzles-per-page', type=positive, default=1, help='Puzzles per page (default: 1).')
+    parser.add_argument('--solutions-per-page', type=positive, default=4, help='Solutions per page (default: 4).')
+    parser.add_argument('--published', nargs='?', const=BANK_FILE, default=None,
+                        help=f'Reject puzzles already published in this bank file (default: {BANK_FILE}) '
+                             'and record the new ones. Implies --unique.')
+
+
+# adds the options choosing how to flatten
+def add_flatten_arguments(parser):
+    parser.add_argument('--flatten', choices=FLATTEN_BACKENDS, default='vector',
+                        help='Flatten by copying the vector pages, or by rasterizing them (default: vector).')
+    parser.add_argument('--threads', type=int, default=1, help='The number of threads used to rasterize the flattened PDF.')
+
+
+# adds the options shaping the clues of every puzzle
+def add_clue_arguments(parser):
+    parser.add_argument('--clues', type=clue_range,
+                        help='Keep exactly N clues, or between LOW-HIGH, in every puzzle (default: as graded).')
+    parser.add_argument('--symmetry', choices=SYMMETRIES, default='none',
+                        help='Lay the clues out symmetrically, with --clues (default: none).')
+
+
+# adds the option overriding the puzzle file format given by its extension
+def add_format_argument(parser):
+    parser.add_argument('--format', choices=('lines', 'jsonl', 'packed'),
+                        help='The puzzle file format (default: from the extension, .txt, .jsonl or .sdk).')
+
+
+# parses "i/N", the i-th (from 0) of N shards
+def shard(value):
+    try:
+        i, n = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected a shard as i/N, got {value!r}.')
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f'Shard {i} is out of range for {n} shards.')
+    return i, n
+
+
+# parses a clue count N or a range LOW-HIGH into (low, high)
+def clue_range(value):
+    try:
+        low, _, high = value.partition('-')
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected a clue count as N or LOW-HIGH, got {value!r}.')
+    if not min(MIN_CLUES.values()) <= low <= high <= 81:
+        raise argparse.ArgumentTypeError(
+            f'Clue counts must be between {min(MIN_CLUES.values())} and 81, got {value!r}.'
+        )
+    return low, high
+
+
+# parses a count that must be at least 1
+def positive(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected a whole number, got {value!r}.')
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'Expected at least 1, got {value!r}.')
+    return number
+
+
+# parses a trim size like "6x9" or "8.5x11", in inches
+def trim(value):
+    try:
+        width, height = (float(x) for x in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected a trim size as WIDTHxHEIGHT, got {value!r}.')
+    return width, height
+
+
+class SharedArgumentParser(argparse.ArgumentParser):
+
+    # a parent parser for subcommand options the top-level parser also has.
+    # They have no defaults here, so a subcommand only sets the options given
+    # after it, and the ones given before it (or the top-level defaults) stand
+    def __init__(self, *add_arguments):
+        super().__init__(add_help=False)
+        for add in add_arguments:
+            add(self)
+
+    def add_argument(self, *args, **kwargs):
+        return super().add_argument(*args, **{**kwargs, 'default': argparse.SUPPRESS})
+
 
 class SudokuArgumentParser(argparse.ArgumentParser):
 
+    # without a command, builds and flattens a book. Options shared with
+    # the subcommands are defined here, with their defaults, and may be given
+    # before or after the command
     def __init__(self):
         super().__init__()
-        self.add_argument('--count', type=int, nargs='?', help='The total number of puzzles to include.')
-        for d in difficulties:
-            name = d.name.lower()
-            self.add_argument(f'--{name}', type=int, default=0, help=f'The number of {name} puzzles to include.')
+        add_common_arguments(self)
+        add_book_arguments(self)
+        add_flatten_arguments(self)
+        self.add_argument('--pipeline', action='store_true',
+                          help='Draw and flatten pages while puzzles are still being generated.')
+        self.add_argument('--chunk-pages', type=int, default=20, help='Pages per flattened chunk with --pipeline.')
+
+        commands = self.add_subparsers(dest='command', parser_class=argparse.ArgumentParser)
+        common = SharedArgumentParser(add_common_arguments)
+        generate = commands.add_parser(
+            'generate', parents=[common], help='Generate puzzles into a puzzle file, without drawing them.'
+        )
+        generate.add_argument('output', help='The file to write: .txt lines, .jsonl or packed .sdk.')
+        add_format_argument(generate)
+        commands.add_parser(
+            'render', parents=[SharedArgumentParser(add_common_arguments, add_book_arguments)],
+            help='Build a book without flattening it.',
+        )
+        flatten = commands.add_parser(
+            'flatten', parents=[SharedArgumentParser(add_flatten_arguments)], help='Flatten an existing PDF.'
+        )
+        flatten.add_argument('input', help='The PDF to flatten.')
+        flatten.add_argument('output', nargs='?', help='Where to write it (default: INPUT-flat.pdf).')
+        validate = commands.add_parser('validate', help='Check puzzles and solutions from a puzzle file.')
+        validate.add_argument('input', help='A file written by the generate or bank export commands.')
+        add_format_argument(validate)
+        bank = commands.add_parser('bank', help='Manage the bank of pre-generated puzzles.')
+        bank_commands = bank.add_subparsers(dest='bank_command', required=True)
+        fill = bank_commands.add_parser('fill', parents=[common], help='Generate puzzles into the bank.')
+        fill.add_argument('--bank', default=BANK_FILE, help=f'The puzzle bank file (default: {BANK_FILE}).')
+        fill.add_argument('--shard', type=shard, default=(0, 1),
+                          help='Only generate shard i of N (e.g. 0/4) of the puzzles. Requires --seed.')
+        serve = commands.add_parser(
+            'serve', parents=[SharedArgumentParser(add_clue_arguments)],
+            help='Run a local build service with a warm pool and puzzle stock.',
+        )
+        serve.add_argument('--host', default='127.0.0.1', help='The address to listen on (default: 127.0.0.1).')
+        serve.add_argument('--port', type=int, default=8765, help='The port to listen on (default: 8765).')
+        serve.add_argument('--workers', type=int, default=argparse.SUPPRESS,
+                           help='The number of processes used to generate puzzles.')
+        serve.add_argument('--buffer', type=int, default=50, help='Ready puzzles kept in stock per difficulty.')
+        serve.add_argument('--unique', action='store_true', default=argparse.SUPPRESS,
+                           help='Never hand out two equivalent puzzles while the service runs.')
+        serve.add_argument('--seed', type=int, default=argparse.SUPPRESS,
+                           help='The seed puzzles are built from (default: a random seed).')
+        merge = bank_commands.add_parser('merge', help='Merge other bank files, e.g. filled shards, into the bank.')
+        merge.add_argument('files', nargs='+', help='The bank files to merge.')
+        merge.add_argument('--bank', default=BANK_FILE, help=f'The puzzle bank file (default: {BANK_FILE}).')
+        check = bank_commands.add_parser('check', help='Check every banked solution against its puzzle.')
+        check.add_argument('--bank', default=BANK_FILE, help=f'The puzzle bank file (default: {BANK_FILE}).')
+        export = bank_commands.add_parser('export', help='Write every banked puzzle to a puzzle file.')
+        export.add_argument('output', help='The file to write: .txt lines, .jsonl or packed .sdk.')
+        export.add_argument('--bank', default=BANK_FILE, help=f'The puzzle bank file (default: {BANK_FILE}).')
+        add_format_argument(export)
 
     def parse_args(self):
         args = super().parse_args().__dict__
@@ -18,10 +193,94 @@ class SudokuArgumentParser(argparse.ArgumentParser):
         if count:
             group_size = round(count / 4)
             args['easy'] = args['medium'] = args['hard'] = args['expert'] = group_size
+        if args.get('symmetry', 'none') != 'none' and not args.get('clues'):
+            self.error('--symmetry needs --clues.')
+        if args.get('clues') and args['clues'][0] < MIN_CLUES[args['symmetry']]:
+            self.error(f"--symmetry {args['symmetry']} needs at least {MIN_CLUES[args['symmetry']]} clues.")
+        if 'seed' in args and args['seed'] is None:
+            if args.get('shard', (0, 1)) != (0, 1):
+                self.error('--shard needs an explicit --seed, shared by every shard.')
+            # picked here so that it's printed and the run can be repeated
+            args['seed'] = random.getrandbits(63)
         return args
 
 
+def run(args):
+    command = args.pop('command')
+    if command == 'generate':
+        from sudoku import export
+        from sudoku.generator import generate_iter
+        difficulty_counts = [(d, args[d.name.lower()]) for d in difficulties]
+        records = generate_iter(
+            difficulty_counts, args['workers'], unique=args['unique'], seed=args['seed'], clues=args['clues'],
+            symmetry=args['symmetry'],
+        )
+        print(f"{export.write(args['output'], records, args['format'])} puzzles written")
+    elif command == 'flatten':
+        from utils import flatten_pdf
+        output = args['output'] or args['input'].removesuffix('.pdf') + '-flat.pdf'
+        flatten_pdf(args['input'], output, thread_count=args['threads'], backend=args['flatten'])
+    elif command == 'validate':
+        from sudoku import batch, export
+        # checked a chunk at a time, so files of any size fit in memory
+        invalid = []
+        total = 0
+        records = export.read(args['input'], args['format'])
+        while chunk := list(islice(records, 100000)):
+            ok = batch.check_solutions(
+                batch.to_array([board for board, _, _ in chunk]), batch.to_array([solution for _, solution, _ in chunk])
+            )
+            invalid += ((~ok).nonzero()[0] + total + 1).tolist()
+            total += len(chunk)
+        print(f'{len(invalid)} of {total} invalid' + (f', puzzles {invalid}' if invalid else ''))
+        if invalid:
+            sys.exit(1)
+    elif command == 'serve':
+        from sudoku.service import serve
+        serve(
+            args['host'], args['port'], args['workers'], args['buffer'], args['seed'], args['unique'], args['clues'],
+            args['symmetry'],
+        )
+    elif command == 'bank':
+        from sudoku.bank import PuzzleBank
+        bank = PuzzleBank(args['bank'])
+        if args['bank_command'] == 'check':
+            invalid = bank.check()
+            print(f'{len(invalid)} invalid records' + (f': {invalid}' if invalid else ''))
+        elif args['bank_command'] == 'export':
+            from sudoku import export
+            print(f"{export.write(args['output'], bank.records(), args['format'])} puzzles written")
+        elif args['bank_command'] == 'merge':
+            print(f"{bank.merge(args['files'])} puzzles merged")
+            print(bank.stock())
+        else:
+            from sudoku.generator import shard_numbers
+            difficulty_counts = [(d, args[d.name.lower()]) for d in difficulties]
+            added = bank.fill(
+                difficulty_counts, args['workers'], args['unique'], args['seed'], args['shard'], args['clues'],
+                args['symmetry'],
+            )
+            requested = sum(len(shard_numbers(c, args['shard'])) for _, c in difficulty_counts)
+            print(f'{added} puzzles added' + (f', {requested - added} already banked' if added < requested else ''))
+            print(bank.stock())
+        bank.close()
+    else:
+        from sudoku.pdf import SudokuPDF
+        if command == 'render':
+            args['flatten'] = None
+        SudokuPDF(unit='in', format=args.pop('trim'), **args).create_pdf()
+
+
 if __name__ == '__main__':
     args = SudokuArgumentParser().parse_args()
     print(args)
-    SudokuPDF(unit='in', format=(6, 9), **args).create_pdf()
+    stats.enabled = args.pop('profile')
+    pstats_file = args.pop('pstats')
+    if pstats_file:
+        profiler = cProfile.Profile()
+        profiler.runcall(run, args)
+        profiler.dump_stats(pstats_file)
+    else:
+        run(args)
+    if stats.enabled:
+        print(stats.report())
@@ -0,0 +1,185 @@
+import os
+import sqlite3
+from itertools import islice
+
+from exceptions import BankExhaustedError
+from .board import Board
+from .difficulty import difficulties
+from .generator import generate_iter, shard_numbers
+
+
+BANK_FILE = 'puzzles.db'
+
+
+# a banked puzzle, remembering what it was generated from
+def _board(puzzle, difficulty, seed, clue_low, clue_high, symmetry):
+    return Board.from_bytes(puzzle, difficulty, seed, (clue_low, clue_high) if clue_high else None, symmetry)
+
+
+class PuzzleBank:
+
+    # opens (and if needed creates) a bank of pre-generated puzzles. Each
+    # record is an 81-byte puzzle plus its 81-byte solution, indexed by
+    # difficulty name and clue count, along with the puzzle's canonical
+    # hash and the seed, clue target (0, 0 for none) and symmetry it was
+    # generated from, everything regenerate() needs. The bank also keeps the
+    # hashes of every puzzle published in a book, so later books can avoid
+    # repeating them
+    def __init__(self, path=BANK_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS puzzles (
+                id INTEGER PRIMARY KEY,
+                difficulty TEXT NOT NULL,
+                clues INTEGER NOT NULL,
+                puzzle BLOB NOT NULL,
+                solution BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS puzzles_difficulty_clues ON puzzles (difficulty, clues);
+            CREATE TABLE IF NOT EXISTS published (hash INTEGER PRIMARY KEY);
+        ''')
+        # banks created before puzzles were hashed, seeded or clue-targeted
+        # lack the columns
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(puzzles)')]
+        for column, kind in (
+            ('hash', 'INTEGER'), ('seed', 'INTEGER'), ('clue_low', 'INTEGER NOT NULL DEFAULT 0'),
+            ('clue_high', 'INTEGER NOT NULL DEFAULT 0'), ('symmetry', "TEXT NOT NULL DEFAULT 'none'"),
+        ):
+            if column not in columns:
+                self.connection.execute(f'ALTER TABLE puzzles ADD COLUMN {column} {kind}')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS puzzles_hash ON puzzles (hash)')
+        # a seed, clue target and symmetry identify a puzzle, so the same
+        # puzzle is never stored twice
+        self.connection.execute('DROP INDEX IF EXISTS puzzles_seed')
+        self.connection.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS puzzles_recipe ON puzzles (seed, clue_low, clue_high, symmetry)'
+        )
+
+    # stores (board, solution, hash) records of the given difficulty,
+    # skipping any already in the bank. Returns how many were stored
+    def add(self, difficulty, records):
+        rows = [
+            (
+                difficulty.name, 81 - board.grid.count(0), board.to_bytes(), solution.to_bytes(), digest, board.seed,
+                *(board.clue_target or (0, 0)), board.symmetry,
+            )
+            for board, solution, digest in records
+        ]
+        with self.connection:
+            return self.connection.executemany(
+                'INSERT OR IGNORE INTO puzzles (difficulty, clues, puzzle, solution, hash, seed, clue_low, clue_high, '
+                'symmetry) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+            ).rowcount
+
+    # generates puzzles for each (difficulty, count) pair and stores them.
+    # With unique set, puzzles equivalent to one already in the bank or
+    # already published are replaced. A seed and shard (i, n) pick out the
+    # same puzzles as generate_iter() does, so shards filled into separate
+    # banks can be merged back together. clues and symmetry are passed on
+    # to every Generator. Returns how many puzzles were stored; puzzles
+    # whose seed was already banked are skipped
+    def fill(self, difficulty_counts, workers=1, unique=False, seed=None, shard=(0, 1), clues=None, symmetry='none'):
+        records = generate_iter(
+            difficulty_counts, workers, unique=unique, seen=self if unique else (), seed=seed, shard=shard,
+            clues=clues, symmetry=symmetry,
+        )
+        return sum(
+            self.add(difficulty, islice(records, len(shard_numbers(count, shard))))
+            for difficulty, count in difficulty_counts
+        )
+
+    # copies every puzzle and published hash from other bank files into
+    # this one. Puzzles are matched by seed, clue target and symmetry, so
+    # merging the same shard
+    # twice changes nothing. Every file must exist; returns how many
+    # puzzles were copied
+    def merge(self, paths):
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f'No bank file at {", ".join(missing)}.')
+        merged = 0
+        for path in paths:
+            PuzzleBank(path).close()  # brings older banks up to date
+            self.connection.execute('ATTACH DATABASE ? AS other', (path,))
+            try:
+                with self.connection:
+                    merged += self.connection.execute(
+                        'INSERT OR IGNORE INTO puzzles '
+                        '(difficulty, clues, puzzle, solution, hash, seed, clue_low, clue_high, symmetry) '
+                        'SELECT difficulty, clues, puzzle, solution, hash, seed, clue_low, clue_high, symmetry '
+                        'FROM other.puzzles'
+                    ).rowcount
+                    self.connection.execute('INSERT OR IGNORE INTO published (hash) SELECT hash FROM other.published')
+            finally:
+                self.connection.execute('DETACH DATABASE other')
+        return merged
+
+    # whether an equivalent puzzle is in stock or has been published
+    def __contains__(self, digest):
+        return self.connection.execute(
+            'SELECT EXISTS (SELECT 1 FROM published WHERE hash = ?) OR EXISTS (SELECT 1 FROM puzzles WHERE hash = ?)',
+            (digest, digest),
+        ).fetchone()[0] == 1
+
+    # records the hashes of puzzles that went into a book
+    def publish(self, hashes):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO published (hash) VALUES (?)', [(h,) for h in hashes if h is not None]
+            )
+
+    # number of puzzles left in the bank, per difficulty name
+    def stock(self):
+        return dict(self.connection.execute('SELECT difficulty, COUNT(*) FROM puzzles GROUP BY difficulty'))
+
+    # takes puzzles for each (difficulty, count) pair out of the bank, so
+    # that no puzzle is ever handed out twice. Nothing is taken unless every
+    # difficulty can be served. Returns one list of (board, solution, hash)
+    # records per difficulty, like generate_iter()
+    def draw(self, difficulty_counts, max_clues=81):
+        batches = []
+        with self.connection:
+            for difficulty, count in difficulty_counts:
+                rows = self.connection.execute(
+                    'SELECT id, puzzle, solution, hash, seed, clue_low, clue_high, symmetry FROM puzzles '
+                    'WHERE difficulty = ? AND clues <= ? LIMIT ?',
+                    (difficulty.name, max_clues, count),
+                ).fetchall()
+                if len(rows) < count:
+                    raise BankExhaustedError(
+                        f'Only {len(rows)} of {count} {difficulty.name} puzzles left in {self.path}.'
+                    )
+                self.connection.executemany('DELETE FROM puzzles WHERE id = ?', [(row[0],) for row in rows])
+                batches.append([
+                    (_board(puzzle, difficulty, *recipe), Board.from_bytes(solution), digest)
+                    for _, puzzle, solution, digest, *recipe in rows
+                ])
+        return batches
+
+    # yields every banked (board, solution, hash) record, oldest first,
+    # without taking them out
+    def records(self):
+        by_name = {d.name: d for d in difficulties}
+        rows = self.connection.execute(
+            'SELECT difficulty, puzzle, solution, hash, seed, clue_low, clue_high, symmetry FROM puzzles ORDER BY id'
+        )
+        for name, puzzle, solution, digest, *recipe in rows:
+            yield _board(puzzle, by_name.get(name), *recipe), Board.from_bytes(solution), digest
+
+    # the ids of the records whose solution is invalid or doesn't match
+    # the puzzle, all checked in one batch
+    def check(self):
+        from . import batch  # numpy is only needed here
+
+        rows = self.connection.execute('SELECT id, puzzle, solution FROM puzzles ORDER BY id').fetchall()
+        if not rows:
+            return []
+        ok = batch.check_solutions(
+            batch.from_bytes(b''.join(row[1] for row in rows)),
+            batch.from_bytes(b''.join(row[2] for row in rows)),
+        )
+        return [row[0] for row, valid in zip(rows, ok) if not valid]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,87 @@
+import numpy as np
+
+from .grid import ALL, COUNT, UNITS, UNITS_OF
+
+# Whole-batch versions of the board checks. A batch is an (N, 81) uint8
+# array with one board per row, row-major, 0 for empty cells; every
+# function works on all N boards with a handful of array operations
+# instead of a Python loop per board.
+
+UNIT_CELLS = np.array(UNITS)            # (27, 9) cells of each unit
+CELL_UNITS = np.array(UNITS_OF)         # (81, 3) units of each cell
+BIT = np.array([0] + [1 << (d - 1) for d in range(1, 10)], dtype=np.uint16)
+POPCOUNT = np.array(COUNT, dtype=np.uint8)
+# the digit of a single-bit mask, 0 for anything else
+DIGIT = np.zeros(ALL + 1, dtype=np.uint8)
+DIGIT[BIT[1:]] = np.arange(1, 10)
+
+
+# stacks boards (anything with a .grid buffer) into a batch
+def to_array(boards):
+    return np.frombuffer(b''.join(bytes(board.grid) for board in boards), dtype=np.uint8).reshape(-1, 81)
+
+
+# builds a batch from concatenated 81-byte records, e.g. bank blobs
+def from_bytes(data):
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 81)
+
+
+# bitmask of the digits present in each unit, (N, 27)
+def unit_masks(grids):
+    return np.bitwise_or.reduce(BIT[grids[:, UNIT_CELLS]], axis=2)
+
+
+# whether no unit of a board repeats a digit (empty cells allowed)
+def consistent(grids):
+    filled = np.count_nonzero(grids[:, UNIT_CELLS], axis=2)
+    return (POPCOUNT[unit_masks(grids)] == filled).all(axis=1)
+
+
+# whether each board is a complete, valid sudoku
+def validate(grids):
+    return (unit_masks(grids) == ALL).all(axis=1)
+
+
+# candidate bitmask of every cell, 0 for filled cells, (N, 81)
+def candidates(grids):
+    used = np.bitwise_or.reduce(unit_masks(grids)[:, CELL_UNITS], axis=2)
+    return np.where(grids == 0, ALL & ~used, 0).astype(np.uint16)
+
+
+# fills in naked and hidden singles across the whole batch until none are
+# left. Returns the filled-in copy, and whether each board is still free of
+# contradictions (no repeated digit, no empty cell without candidates).
+# Each sweep only looks at the boards that changed in the previous one
+def propagate(grids):
+    grids = grids.copy()
+    active = np.arange(len(grids))
+    while len(active):
+        current = grids[active]
+        masks = candidates(current)
+        naked = DIGIT[masks]
+
+        # digits that are a candidate in exactly one cell of each unit
+        cells = masks[:, UNIT_CELLS]                                 # (n, 27, 9)
+        once = np.zeros(cells.shape[:2], dtype=np.uint16)
+        twice = np.zeros_like(once)
+        for k in range(9):
+            twice |= once & cells[:, :, k]
+            once |= cells[:, :, k]
+        only = once & ~twice
+        hidden = np.bitwise_or.reduce(only[:, CELL_UNITS], axis=2) & masks
+        hidden = DIGIT[hidden & -hidden]
+
+        placed = np.where(naked > 0, naked, hidden)
+        changed = placed.any(axis=1)
+        grids[active] = current + placed
+        active = active[changed]
+    stuck = ((grids == 0) & (candidates(grids) == 0)).any(axis=1)
+    return grids, consistent(grids) & ~stuck
+
+
+# whether each solution is a valid sudoku that agrees with its puzzle's
+# clues, and with everything singles deduce from those clues
+def check_solutions(puzzles, solutions):
+    filled, ok = propagate(puzzles)
+    agrees = ((filled == 0) | (filled == solutions)).all(axis=1)
+    return validate(solutions) & ok & agrees
@@ -1,99 +1,182 @@
+from array import array
+
+from sudoku import stats
 from sudoku.cell import Cell
+from sudoku.grid import ALL, BIT, BOXES, COL_SEGMENT_OF, COLUMNS, DIGITS_OF, ROW_SEGMENT_OF, ROWS, UNITS, UNITS_OF
+
+# maps cell values to the characters of to_string, and back
+STRING_TABLE = bytes(b'.123456789' + bytes(246))
+VALUE_TABLE = bytes(48) + bytes(range(10)) + bytes(198)
 
 
 class Board:
 
-    difficulty = None  # Overwritten by the SudokuGenerator
+    __slots__ = ('grid', 'difficulty', 'seed', 'clue_target', 'symmetry', 'counts', 'masks', 'filled', 'segments', 'views')
 
     # initializing a board
     def __init__(self, numbers=None):
-        # we keep list of cells and dictionaries to point to each cell
-        # by various locations
-        self.rows = {}
-        self.columns = {}
-        self.boxes = {}
-        self.cells = []
-
-        # looping rows
-        for row in range(0, 9):
-            # looping columns
-            for col in range(0, 9):
-                # calculating box
-                box = 3 * (row // 3) + (col // 3)
-
-                # creating cell instance
-                cell = Cell(row, col, box)
-
-                # if initial set is given, set cell value
-                if numbers is not None:
-                    cell.value = numbers.pop(0)
-                else:
-                    cell.value = 0
-
-                # initializing dictionary keys and corresponding lists
-                # if they are not initialized
-                if row not in self.rows:
-                    self.rows[row] = []
-                if col not in self.columns:
-                    self.columns[col] = []
-                if box not in self.boxes:
-                    self.boxes[box] = []
-
-                # adding cells to each list
-                self.rows[row].append(cell)
-                self.columns[col].append(cell)
-                self.boxes[box].append(cell)
-                self.cells.append(cell)
+        # the board is a flat, row-major buffer of 81 values (0 for empty);
+        # cells, rows, columns and boxes are views built from index tables.
+        # Values must be changed through set() so that the tracking below
+        # stays in step with the grid
+        self.grid = bytearray(81) if numbers is None else bytearray(numbers)
+        self.difficulty = None  # Overwritten by the SudokuGenerator
+        self.seed = None  # The seed a generated puzzle was built from
+        self.clue_target = None  # and the (low, high) clues it was built for
+        self.symmetry = 'none'  # and the symmetry of its clue pattern
+        self.views = None  # The 81 Cell views, built on first use
+        self._recount()
+
+    # rebuilds the incrementally tracked state from scratch:
+    #   counts[u * 10 + d]  how often digit d occurs in unit u (27 units)
+    #   masks[u]            bitmask of the digits present in unit u
+    #   filled[u]           number of filled cells in unit u
+    #   segments[s]         filled cells per row segment (0-26) and column
+    #                       segment (27-53), the 3 cells a row or column
+    #                       shares with a box
+    def _recount(self):
+        self.counts = bytearray(270)
+        self.masks = array('H', bytes(54))
+        self.filled = bytearray(27)
+        self.segments = bytearray(54)
+        for index, value in enumerate(self.grid):
+            if value:
+                self._track(index, value, 1)
+
+    # adds (delta=1) or removes (delta=-1) one occurrence of a digit
+    def _track(self, index, digit, delta):
+        counts, masks, filled = self.counts, self.masks, self.filled
+        for unit in UNITS_OF[index]:
+            n = counts[unit * 10 + digit] + delta
+            counts[unit * 10 + digit] = n
+            if n == 0:
+                masks[unit] &= ~BIT[digit]
+            elif n == 1 and delta > 0:
+                masks[unit] |= BIT[digit]
+            filled[unit] += delta
+        self.segments[ROW_SEGMENT_OF[index]] += delta
+        self.segments[27 + COL_SEGMENT_OF[index]] += delta
+
+    # sets the value of a cell, keeping the tracked state up to date
+    def set(self, index, value):
+        old = self.grid[index]
+        if old == value:
+            return
+        if old:
+            self._track(index, old, -1)
+        if value:
+            self._track(index, value, 1)
+        self.grid[index] = value
+
+    # replaces every value of the board at once
+    def load(self, values):
+        self.grid[:] = values
+        self._recount()
+
+    # the board's Cell views, one per index, built once and shared by the
+    # accessors below. A view reads the board's current grid, so it stays
+    # valid across set(), swaps and permute()
+    def _views(self):
+        if self.views is None:
+            self.views = [Cell(self, i) for i in range(81)]
+        return self.views
+
+    @property
+    def cells(self):
+        return list(self._views())
+
+    @property
+    def rows(self):
+        views = self._views()
+        return {r: [views[i] for i in indices] for r, indices in enumerate(ROWS)}
+
+    @property
+    def columns(self):
+        views = self._views()
+        return {c: [views[i] for i in indices] for c, indices in enumerate(COLUMNS)}
+
+    @property
+    def boxes(self):
+        views = self._views()
+        return {b: [views[i] for i in indices] for b, indices in enumerate(BOXES)}
 
     @property
     def values(self):
-        return [[cell.value or '' for cell in row] for _, row in sorted(self.rows.items())]
+        grid = self.grid
+        return [[grid[i] or '' for i in indices] for indices in ROWS]
 
     # returning cells in puzzle that are not set to zero
     def get_used_cells(self):
-        return [x for x in self.cells if x.value != 0]
+        views = self._views()
+        return [views[i] for i, value in enumerate(self.grid) if value != 0]
 
     # returning cells in puzzle that are set to zero
     def get_unused_cells(self):
-        return [x for x in self.cells if x.value == 0]
+        views = self._views()
+        return [views[i] for i, value in enumerate(self.grid) if value == 0]
+
+    # bitmask of the values the cell's peers already use, besides its own
+    def _excluded_mask(self, index):
+        r, c, b = UNITS_OF[index]
+        masks = self.masks
+        return (masks[r] | masks[c] | masks[b]) & ~BIT[self.grid[index]]
 
     # returning all possible values that could be assigned to the
     # cell provided as argument
     def get_possibles(self, cell):
-        possibilities = self.rows[cell.row] + self.columns[cell.col] + self.boxes[cell.box]
-        excluded = set([x.value for x in possibilities if x.value != 0 and x.value != cell.value])
-        results = [x for x in range(1, 10) if x not in excluded]
-        return results
+        return list(DIGITS_OF[ALL & ~self._excluded_mask(cell.index)])
 
-    # calculates the density of a specific cell's context
+    # calculates the density of a specific cell's context, i.e. the share of
+    # its 20 peers that are filled
     def get_density(self, cell):
-        possibilities = self.rows[cell.row] + self.columns[cell.col] + self.boxes[cell.box]
-        if cell.value != 0:
-            possibilities.remove(cell)
-        return len([x for x in set(possibilities) if x.value != 0]) / 20.0
+        return self.density(cell.index)
+
+    # the density of the cell at index, from the running counts. A row,
+    # column and box overlap in the cell itself and in its row and column
+    # segments, so those are subtracted once
+    def density(self, index):
+        r, c, b = UNITS_OF[index]
+        filled, segments = self.filled, self.segments
+        peers = (
+            filled[r] + filled[c] + filled[b]
+            - segments[ROW_SEGMENT_OF[index]] - segments[27 + COL_SEGMENT_OF[index]]
+            - (self.grid[index] != 0)
+        )
+        return peers / 20.0
+
+    # whether the empty cell at index has to hold value: its peers rule out
+    # every other digit, or rule value out of every other empty cell of
+    # one of its units
+    def forced(self, index, value):
+        bit = BIT[value]
+        if self._excluded_mask(index) == ALL & ~bit:
+            return True
+        grid = self.grid
+        for unit in UNITS_OF[index]:
+            if all(grid[i] or i == index or self._excluded_mask(i) & bit for i in UNITS[unit]):
+                return True
+        return False
 
     # gets complement of possibles, values that cell cannot be
     def get_excluded(self, cell):
-        possibilities = self.rows[cell.row] + self.columns[cell.col] + self.boxes[cell.box]
-        return set([x.value for x in possibilities if x.value != 0 and x.value != cell.value])
+        return set(DIGITS_OF[self._excluded_mask(cell.index)])
 
     # swaps two rows
     def swap_row(self, row_index1, row_index2, allow=False):
         if allow or row_index1 // 3 == row_index2 // 3:
-            for x in range(0, len(self.rows[row_index2])):
-                temp = self.rows[row_index1][x].value
-                self.rows[row_index1][x].value = self.rows[row_index2][x].value
-                self.rows[row_index2][x].value = temp
+            a, b = row_index1 * 9, row_index2 * 9
+            grid = self.grid
+            grid[a:a + 9], grid[b:b + 9] = grid[b:b + 9], grid[a:a + 9]
+            self._recount()
         else:
             raise Exception('Tried to swap non-familial rows.')
 
     # swaps two columns
     def swap_column(self, col_index1, col_index2, allow=False):
         if allow or col_index1 // 3 == col_index2 // 3:
-            for x in range(0, len(self.columns[col_index2])):
-                temp = self.columns[col_index1][x].value
-                self.columns[col_index1][x].value = self.columns[col_index2][x].value
-                self.columns[col_index2][x].value = temp
+            grid = self.grid
+            grid[col_index1::9], grid[col_index2::9] = grid[col_index2::9], grid[col_index1::9]
+            self._recount()
         else:
             raise Exception('Tried to swap non-familial columns.')
 
@@ -107,42 +190,77 @@ class Board:
         for x in range(0, 3):
             self.swap_row(band_index1 * 3 + x, band_index2 * 3 + x, True)
 
+    # rearranges the whole board in a single pass: new row r is old row
+    # rows[r] and new column c is old column cols[c] (read from the
+    # transposed board if transpose is set), and every digit d becomes
+    # digits[d]. The result stays a valid sudoku as long as rows and cols
+    # only move whole bands/stacks and rows/columns within them
+    def permute(self, rows, cols, transpose=False, digits=range(10)):
+        if transpose:
+            source = [cols[c] * 9 + rows[r] for r in range(9) for c in range(9)]
+        else:
+            source = [rows[r] * 9 + cols[c] for r in range(9) for c in range(9)]
+        grid = self.grid
+        table = bytes(digits) + bytes(range(10, 256))
+        self.grid = bytearray(grid[i] for i in source).translate(table)
+        self._recount()
+
     # copies the board
     def copy(self):
-        b = Board()
-        for row in range(0, len(self.rows)):
-            for col in range(0, len(self.columns)):
-                b.rows[row][col].value = self.rows[row][col].value
+        if stats.enabled:
+            stats.count('board_copies')
+        b = Board.__new__(Board)
+        b.grid = self.grid[:]
+        b.difficulty = None
+        b.seed = None
+        b.clue_target = None
+        b.symmetry = 'none'
+        b.counts = self.counts[:]
+        b.masks = self.masks[:]
+        b.filled = self.filled[:]
+        b.segments = self.segments[:]
+        b.views = None
         return b
 
+    # packs the board into 81 bytes, one per cell, row by row
+    def to_bytes(self):
+        return bytes(self.grid)
+
+    # builds a board from the 81 bytes produced by to_bytes, along with
+    # what it was generated from, if known
+    @classmethod
+    def from_bytes(cls, data, difficulty=None, seed=None, clue_target=None, symmetry='none'):
+        board = cls(data)
+        board.difficulty = difficulty
+        board.seed = seed
+        board.clue_target = clue_target
+        board.symmetry = symmetry
+        return board
+
+    # the board as 81 characters, row by row, with '.' for empty cells
+    def to_string(self):
+        return bytes(self.grid).translate(STRING_TABLE).decode()
+
+    # builds a board from the 81 characters produced by to_string ('0' is
+    # also read as an empty cell). Anything but 81 of '.0-9' is a ValueError
+    @classmethod
+    def from_string(cls, text, difficulty=None):
+        data = text.replace('.', '0').encode()
+        if len(data) != 81 or not data.isdigit():
+            raise ValueError(f'Expected a board as 81 characters of .0-9, got {text!r}.')
+        return cls.from_bytes(data.translate(VALUE_TABLE), difficulty)
+
     # returns string representation
     def __str__(self):
         output = []
-        for index, row in self.rows.items():
-            my_set = map(str, [x.value for x in row])
-            new_set = []
-            for x in my_set:
-                if x == '0':
-                    new_set.append("_")
-                else:
-                    new_set.append(x)
-            output.append('|'.join(new_set))
+        for indices in ROWS:
+            output.append('|'.join(str(self.grid[i]) if self.grid[i] else '_' for i in indices))
         return '\r\n'.join(output)
 
     # exporting puzzle to a html table for prettier visualization
     def html(self):
-        html = "<table>"
-        for index, row in self.rows.items():
-            values = []
-            row_string = "<tr>"
-            for x in row:
-                if x.value == 0:
-                    values.append(" ")
-                    row_string += "<td>%s</td>"
-                else:
-                    values.append(x.value)
-                    row_string += "<td>%d</td>"
-            row_string += "</tr>"
-            html += row_string % tuple(values)
-        html += "</table>"
-        return html
+        rows = (
+            '<tr>' + ''.join(f'<td>{self.grid[i] or " "}</td>' for i in indices) + '</tr>'
+            for indices in ROWS
+        )
+        return '<table>' + ''.join(rows) + '</table>'
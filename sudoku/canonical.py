@@ -0,0 +1,106 @@
+from hashlib import blake2b
+from itertools import permutations, product
+
+# every column order that keeps stacks together: a permutation of the
+# stacks, then a permutation of the columns within each stack
+COLUMN_ORDERS = [
+    tuple(stack * 3 + column for stack, inner in zip(stacks, inners) for column in inner)
+    for stacks in permutations(range(3))
+    for inners in product(permutations(range(3)), repeat=3)
+]
+
+# the lowest zero/clue pattern a row with a given clue mask can be turned
+# into, and the column orders that produce it. Filled lazily, there are at
+# most 512 masks
+_first_rows = {}
+
+
+def _first_row(mask):
+    if mask not in _first_rows:
+        best, orders = None, []
+        for order in COLUMN_ORDERS:
+            pattern = tuple((mask >> c) & 1 for c in order)
+            if best is None or pattern < best:
+                best, orders = pattern, [order]
+            elif pattern == best:
+                orders.append(order)
+        _first_rows[mask] = best, orders
+    return _first_rows[mask]
+
+
+# the source rows that may become output row k, given the rows used so far:
+# the rest of the current band, or any row of a band not used yet
+def _next_rows(used, k):
+    if k % 3:
+        band = used[-1] // 3
+        return [r for r in range(band * 3, band * 3 + 3) if r not in used]
+    used_bands = {r // 3 for r in used}
+    return [r for r in range(9) if r // 3 not in used_bands]
+
+
+# maps a flat 81-int grid (0 for empty cells) to the canonical member of its
+# class under the sudoku symmetry group: band, row, stack and column
+# permutations, transposition and digit relabeling. The canonical form is
+# the lexicographically smallest grid in the class, with digits relabeled
+# in order of first appearance. It's found row by row, keeping only the
+# transformations that tie for the smallest rows so far
+def canonical_form(grid):
+    grid = list(grid)
+    transposed = [grid[c * 9 + r] for r in range(9) for c in range(9)]
+
+    # The first row's digits always relabel to 1, 2, 3, ... in order, so
+    # only its zero/clue pattern matters
+    best, candidates = None, []
+    for g in (grid, transposed):
+        for r in range(9):
+            row = g[r * 9:r * 9 + 9]
+            pattern, orders = _first_row(sum(1 << c for c in range(9) if row[c]))
+            if best is None or pattern < best:
+                best, candidates = pattern, []
+            if pattern == best:
+                for order in orders:
+                    labels = [0] * 10
+                    n = 0
+                    for c in order:
+                        if row[c]:
+                            n += 1
+                            labels[row[c]] = n
+                    candidates.append((g, (r,), order, labels, n))
+
+    output = []
+    label = 0
+    for value in best:
+        if value:
+            label += 1
+        output.append(label if value else 0)
+
+    for k in range(1, 9):
+        best, survivors = None, []
+        for g, used, order, labels, n in candidates:
+            for r in _next_rows(used, k):
+                row = g[r * 9:r * 9 + 9]
+                new_labels, m = labels[:], n
+                out = []
+                for c in order:
+                    value = row[c]
+                    if value:
+                        if not new_labels[value]:
+                            m += 1
+                            new_labels[value] = m
+                        out.append(new_labels[value])
+                    else:
+                        out.append(0)
+                if best is None or out < best:
+                    best, survivors = out, []
+                if out == best:
+                    survivors.append((g, used + (r,), order, new_labels, m))
+        output.extend(best)
+        candidates = survivors
+
+    return bytes(output)
+
+
+# a compact 64-bit hash of a puzzle's canonical form; equivalent puzzles
+# share the same hash
+def puzzle_hash(grid):
+    return int.from_bytes(blake2b(canonical_form(grid), digest_size=8).digest(), 'big', signed=True)
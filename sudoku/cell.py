@@ -1,12 +1,35 @@
+from .grid import BOX_OF, COL_OF, ROW_OF
+
+
 class Cell:
 
-    # defining the cell, each cell keeps track of its own value and location
-    def __init__(self, row, col, box):
-        self.row = row
-        self.col = col
-        self.box = box
+    __slots__ = ('board', 'index')
+
+    # a cell is a lightweight view onto one entry of its board's buffer,
+    # so reading or setting its value reads or writes the board directly
+    def __init__(self, board, index):
+        self.board = board
+        self.index = index
+
+    @property
+    def row(self):
+        return ROW_OF[self.index]
+
+    @property
+    def col(self):
+        return COL_OF[self.index]
+
+    @property
+    def box(self):
+        return BOX_OF[self.index]
+
+    @property
+    def value(self):
+        return self.board.grid[self.index]
 
-        self.value = 0
+    @value.setter
+    def value(self, value):
+        self.board.set(self.index, value)
 
     # returns a string representation of cell (for debugging)
     def __str__(self):
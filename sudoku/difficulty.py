@@ -1,16 +1,35 @@
 class Difficulty():
 
-    def __init__(self, name, logical_cutoff=35, random_cutoff=0):
+    # the cutoffs bound how many cells the generator blanks; the score band
+    # [low, high), with None for no bound, is the range of grader scores a
+    # puzzle of this difficulty must land in. Bands are half-open so that
+    # neighbouring levels never share a score
+    def __init__(self, name, logical_cutoff=35, random_cutoff=0, score_band=(None, None)):
         self.name = name.title()
         self.logical_cutoff = logical_cutoff
         self.random_cutoff = random_cutoff
+        self.score_band = score_band
+
+    # whether a grader score falls inside the band
+    def accepts(self, score):
+        low, high = self.score_band
+        return (low is None or score >= low) and (high is None or score < high)
+
+    # how far a score is from the band, 0 if inside it
+    def distance(self, score):
+        low, high = self.score_band
+        if low is not None and score < low:
+            return low - score
+        if high is not None and score >= high:
+            return score - high + 1
+        return 0
 
     def __repr__(self):
-        return f'<Difficulty: {self.name} ({self.logical_cutoff}, {self.random_cutoff})>'
+        return f'<Difficulty: {self.name} ({self.logical_cutoff}, {self.random_cutoff}, {self.score_band})>'
 
 difficulties = [
-    Difficulty('Easy', 35, 0),
-    Difficulty('Medium', 81, 5),
-    Difficulty('Hard', 81, 10),
-    Difficulty('Expert', 81, 15),
-]
\ No newline at end of file
+    Difficulty('Easy', 35, 0, (None, 40)),
+    Difficulty('Medium', 81, 5, (40, 47)),
+    Difficulty('Hard', 81, 10, (47, 56)),
+    Difficulty('Expert', 81, 15, (56, 200)),
+]
@@ -0,0 +1,165 @@
+import json
+import mmap
+import os
+
+from .board import Board
+from .difficulty import difficulties
+
+# Puzzles are written and read as (board, solution, hash) records, like
+# generate_iter() yields, one at a time so files of any size stream through.
+# Three formats, picked by file extension:
+#   .txt    "difficulty puzzle solution" lines, 81 characters per board
+#   .jsonl  one JSON object per puzzle, with its hash and clue count, and
+#           the seed, clue target and symmetry regenerate() rebuilds it from
+#   .sdk    packed: a header, then two 41-byte records per puzzle (puzzle,
+#           solution), one nibble per cell. The spare nibble at the end of
+#           the puzzle record holds the difficulty. Every puzzle has the same
+#           size, so puzzle n can be read straight from a memory map
+FORMATS = {'.txt': 'lines', '.jsonl': 'jsonl', '.sdk': 'packed'}
+
+MAGIC = b'SUDOKU\x00\x01'
+RECORD_SIZE = 41
+ENTRY_SIZE = RECORD_SIZE * 2
+
+# byte -> its high and low nibble, for unpacking with bytes.translate()
+HIGH = bytes(b >> 4 for b in range(256))
+LOW = bytes(b & 15 for b in range(256))
+
+# difficulty codes for the packed format, 0 for none
+DIFFICULTY_CODES = {d.name: n for n, d in enumerate(difficulties, 1)}
+
+
+def format_of(path, format=None):
+    if format:
+        return format
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f'Unknown puzzle file type {extension!r}, expected one of {", ".join(FORMATS)}.')
+    return FORMATS[extension]
+
+
+# packs 81 cell values, plus a 4-bit code in the spare nibble, into 41 bytes
+def pack(grid, code=0):
+    return bytes(a << 4 | b for a, b in zip(grid[0::2], bytes(grid[1::2]) + bytes([code])))
+
+
+# unpacks 41 bytes into the 81 cell values and the spare nibble's code
+def unpack(record):
+    values = bytearray(82)
+    values[0::2] = record.translate(HIGH)
+    values[1::2] = record.translate(LOW)
+    return values[:81], values[81]
+
+
+def _difficulty(name):
+    return next((d for d in difficulties if d.name.lower() == (name or '').lower()), None)
+
+
+# writes the records to path in the given (or the path's) format, and
+# returns how many were written
+def write(path, records, format=None):
+    format = format_of(path, format)
+    count = 0
+    with open(path, 'wb' if format == 'packed' else 'w') as f:
+        if format == 'packed':
+            f.write(MAGIC)
+        for board, solution, digest in records:
+            difficulty = board.difficulty.name if board.difficulty else None
+            if format == 'packed':
+                f.write(pack(board.grid, DIFFICULTY_CODES.get(difficulty, 0)) + pack(solution.grid))
+            elif format == 'jsonl':
+                f.write(json.dumps({
+                    'difficulty': difficulty,
+                    'puzzle': board.to_string(),
+                    'solution': solution.to_string(),
+                    'clues': 81 - board.grid.count(0),
+                    'seed': board.seed,
+                    'clue_target': board.clue_target,
+                    'symmetry': board.symmetry,
+                    'hash': digest,
+                }) + '\n')
+            else:
+                f.write(f'{(difficulty or "-").lower()} {board.to_string()} {solution.to_string()}\n')
+            count += 1
+    return count
+
+
+# yields the records stored in path, reading one at a time. A line that
+# can't be read raises a ValueError naming it
+def read(path, format=None):
+    format = format_of(path, format)
+    if format == 'packed':
+        with PackedPuzzles(path) as puzzles:
+            yield from puzzles
+        return
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = _parse(line, format)
+            except KeyError as e:
+                raise ValueError(f'{path}, line {number}: missing {e}.') from e
+            except ValueError as e:
+                raise ValueError(f'{path}, line {number}: {e}') from e
+            yield record
+
+
+# the record on one line of a lines or jsonl file
+def _parse(line, format):
+    if format == 'jsonl':
+        item = json.loads(line)
+        if not isinstance(item, dict):
+            raise ValueError(f'Expected a JSON object, got {line.strip()!r}.')
+        board = Board.from_string(item['puzzle'], _difficulty(item.get('difficulty')))
+        board.seed = item.get('seed')
+        board.clue_target = tuple(item['clue_target']) if item.get('clue_target') else None
+        board.symmetry = item.get('symmetry', 'none')
+        return board, Board.from_string(item['solution']), item.get('hash')
+    fields = line.split()
+    if len(fields) < 3:
+        raise ValueError(f'Expected "difficulty puzzle solution", got {line.strip()!r}.')
+    name, puzzle, solution = fields[:3]
+    return Board.from_string(puzzle, _difficulty(name)), Board.from_string(solution), None
+
+
+class PackedPuzzles:
+
+    # random access into a packed file through a memory map, so puzzle n
+    # of a file of any size is read without loading the rest
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if self.map[:len(MAGIC)] != MAGIC or (size - len(MAGIC)) % ENTRY_SIZE:
+            self.close()
+            raise ValueError(f'{path} is not a packed puzzle file.')
+
+    def __len__(self):
+        return (len(self.map) - len(MAGIC)) // ENTRY_SIZE
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        offset = len(MAGIC) + n * ENTRY_SIZE
+        puzzle, code = unpack(self.map[offset:offset + RECORD_SIZE])
+        solution, _ = unpack(self.map[offset + RECORD_SIZE:offset + ENTRY_SIZE])
+        difficulty = difficulties[code - 1] if code else None
+        return Board.from_bytes(puzzle, difficulty), Board.from_bytes(solution), None
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
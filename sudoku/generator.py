@@ -1,74 +1,123 @@
 import random
-from functools import reduce
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, reduce
+from hashlib import blake2b
+from itertools import islice
 
+from . import stats
 from .board import Board
-from .solver import Solver
+from .canonical import puzzle_hash
+from .grader import score
+from .grid import MIN_CLUES, SYMMETRIES
+from .solver import Solver, count_solutions, solutions
 
 
 BASE_FILE = 'base.txt'
 
+# how many puzzles are tried for one that lands in the difficulty's score
+# band; past that the closest one is kept
+MAX_ATTEMPTS = 100
+
+# how many blanked cell groups a clue-targeted reduction may put back and
+# try otherwise before it gives up on the attempt
+MAX_BACKTRACKS = 5
+
 class Generator:
 
-    # constructor for generator, reads in a space delimited
-    def __init__(self, difficulty):
+    # constructor for generator, reads in a space delimited. Every random
+    # choice is drawn from rng, so a generator given a Random seeded the
+    # same way always builds the same puzzle. With clues (low, high), the
+    # puzzle keeps between low and high clues, laid out with the given
+    # symmetry, instead of following the difficulty's cutoffs. low must be
+    # at least MIN_CLUES for the symmetry
+    def __init__(self, difficulty, rng=None, clues=None, symmetry='none'):
+        if clues and clues[0] < MIN_CLUES[symmetry]:
+            raise ValueError(f'{symmetry.capitalize()} puzzles need at least {MIN_CLUES[symmetry]} clues.')
+        self.rng = rng or random.Random()
+        stats.scope = difficulty.name
+        if stats.enabled:
+            stats.count('puzzles')
+
         # Instantiate the starting board
-        with open(BASE_FILE) as f:
-            # reducing file to a list of numbers
-            numbers = filter(lambda x: x in '123456789', list(reduce(lambda x, y: x + y, f.readlines())))
-            numbers = list(map(int, numbers))
+        numbers = base_numbers()
 
-        # constructing board
-        self.board = Board(numbers)
-        self.solution = self.board.copy()
-        self._populate_board(difficulty)
+        # constructing boards until one is graded into the difficulty's
+        # score band or, with a clue target, until one has a clue count on
+        # target, whatever its score; failing that, the one closest to the
+        # target, then to the band, is kept. `missed` is how many clues the
+        # kept puzzle is outside the target by
+        best = None
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt and stats.enabled:
+                stats.count('regrades')
+            self.board = Board(numbers)
+            on_target = self._populate_board(difficulty, clues, symmetry)
+            with stats.timer('grade'):
+                self.score = score(self.board.grid)
+            missed = 0 if on_target else _clue_miss(81 - self.board.grid.count(0), clues)
+            if not missed and (clues or difficulty.accepts(self.score)):
+                break
+            distance = (missed, difficulty.distance(self.score))
+            if best is None or distance < best[3]:
+                best = (self.board, self.solution, self.score, distance)
+        else:
+            self.board, self.solution, self.score, (missed, _) = best
+        self.missed = missed
+        if missed:
+            if stats.enabled:
+                stats.count('clue_misses')
+            low, high = clues
+            warnings.warn(
+                f'No {difficulty.name} puzzle with {low}-{high} clues found in {MAX_ATTEMPTS} attempts; '
+                f'kept one with {81 - self.board.grid.count(0)}.'
+            )
 
-    def _populate_board(self, difficulty):
+    # returns whether the puzzle's clue count is on target
+    def _populate_board(self, difficulty, clues=None, symmetry='none'):
         self.board.difficulty = difficulty
         # applying random transformations to the finished puzzle
-        self._randomize(100)
+        with stats.timer('randomize'):
+            self._randomize()
+        self.solution = self.board.copy()
+        if clues:
+            with stats.timer('reduce_to_clues'):
+                return self._reduce_to_clues(*clues, symmetry)
         # Use difficulty cutoffs to apply logical & random reduction
-        self._reduce_via_logical(difficulty.logical_cutoff)
+        with stats.timer('reduce_via_logical'):
+            self._reduce_via_logical(difficulty.logical_cutoff)
         if difficulty.random_cutoff:
-            self._reduce_via_random(difficulty.random_cutoff)
-        return self.board
+            with stats.timer('reduce_via_random'):
+                self._reduce_via_random(difficulty.random_cutoff)
+        return True
 
-    # function randomizes an existing complete puzzle
-    def _randomize(self, iterations):
+    # function randomizes an existing complete puzzle by applying a random
+    # element of the sudoku symmetry group: a permutation of the bands, of
+    # the rows within each band, of the stacks and of the columns within
+    # each stack, an optional transposition and a relabeling of the digits
+    def _randomize(self, check=False):
 
         # not allowing transformations on a partial puzzle
-        if len(self.board.get_used_cells()) != 81:
+        if 0 in self.board.grid:
             raise ValueError('Rearranging partial board may compromise uniqueness.')
 
-        # looping through iterations
-        for x in range(0, iterations):
-
-            # to get a random column/row
-            case = random.randint(0, 4)
-
-            # to get a random band/stack
-            block = random.randint(0, 2) * 3
-
-            # in order to select which row and column we shuffle an array of
-            # indices and take both elements
-            piece1, piece2 = random.sample([0, 1, 2], 2)
-
-            # pick case according to random to do transformation
-            if case == 0:
-                self.board.swap_row(block + piece1, block + piece2)
-            elif case == 1:
-                self.board.swap_column(block + piece1, block + piece2)
-            elif case == 2:
-                self.board.swap_stack(piece1, piece2)
-            elif case == 3:
-                self.board.swap_band(piece1, piece2)      
+        rng = self.rng
+        self.board.permute(
+            rows=_random_line_order(rng),
+            cols=_random_line_order(rng),
+            transpose=rng.random() < 0.5,
+            digits=[0] + rng.sample(range(1, 10), 9),
+        )
 
-        assert Solver(self.board).is_valid(), f'Invalid Sudoku board!\n{self.board}'
+        if check:
+            assert Solver(self.board).is_valid(), f'Invalid Sudoku board!\n{self.board}'
 
     # method gets all possible values for a particular cell, if there is only one
     # then we can remove that cell
     def _reduce_via_logical(self, cutoff=81):
         cells = self.board.get_used_cells()
-        random.shuffle(cells)
+        self.rng.shuffle(cells)
         for cell in cells:
             if len(self.board.get_possibles(cell)) == 1:
                 cell.value = 0
@@ -89,39 +138,250 @@ class Generator:
         for cell in elements:
             original = cell.value
 
-            # get list of other values to try in its place
-            complement = [x for x in range(1, 10) if x != original]
-            ambiguous = False
-
-            # check each value in list of other possibilities to try
-            for x in complement:
-
-                # set cell to value
-                cell.value = x
+            # remove the cell and keep it removed only if the puzzle still
+            # has exactly one solution
+            cell.value = 0
+            if count_solutions(temp) != 1:
+                cell.value = original
+            else:
+                cutoff -= 1
 
-                # create instance of solver
-                s = Solver(temp)
+            # if we ever meet the cutoff limit we can break out
+            if cutoff == 0:
+                break
 
-                # if solver can fill every box and the solution is valid then
-                # puzzle becomes ambiguous after removing particular cell, so we can break out
-                if s.solve() and s.is_valid():
-                    cell.value = original
-                    ambiguous = True
+    # blanks cells until between low and high clues are left (a count
+    # picked at random in that range), keeping the solution unique. Cells
+    # go in groups the symmetry maps onto each other, so the pattern keeps
+    # it. The next group is always the one whose peers are most filled,
+    # re-ranked after every removal from the board's running counts. When
+    # no group can go, the last one blanked is put back and ruled out, up
+    # to MAX_BACKTRACKS times. Returns whether the target was reached
+    def _reduce_to_clues(self, low, high, symmetry='none'):
+        board = self.board
+        target = self.rng.randint(low, high)
+        self.unavoidable = []
+        groups = list(SYMMETRIES[symmetry])
+        self.rng.shuffle(groups)  # breaks ties between equally dense groups
+        clues = 81
+        # groups that can't be blanked without losing uniqueness. Blanking
+        # more cells never brings uniqueness back, so a group stays stuck
+        # until a removal before it is undone
+        stuck = set()
+        removed = []
+        backtracks = 0
+        while clues > target:
+            group = self._densest_group(groups, stuck, clues - low)
+            if group is None:
+                if low <= clues <= high or not removed or backtracks == MAX_BACKTRACKS:
                     break
+                if stats.enabled:
+                    stats.count('clue_backtracks')
+                backtracks += 1
+                group, values, stuck = removed.pop()
+                for index, value in zip(group, values):
+                    board.set(index, value)
+                clues += len(group)
+                stuck = stuck | {group}
+                continue
+            values = [board.grid[index] for index in group]
+            if self._blank(group):
+                removed.append((group, values, set(stuck)))
+                clues -= len(group)
+            else:
+                stuck.add(group)
+        return low <= clues <= high
 
-            # if every value was checked and puzzle remains unique, we can remove it
-            if not ambiguous:
-                cell.value = 0
-                cutoff -= 1
+    # the filled, not stuck group of at most `room` cells with the highest
+    # density, or None
+    def _densest_group(self, groups, stuck, room):
+        board = self.board
+        best, best_density = None, -1
+        for group in groups:
+            if len(group) > room or not board.grid[group[0]] or group in stuck:
+                continue
+            density = sum(board.density(index) for index in group) / len(group)
+            if density > best_density:
+                best, best_density = group, density
+        return best
 
-            # if we ever meet the cutoff limit we can break out
-            if cutoff == 0:
+    # blanks a group of cells if the puzzle stays unique, and returns
+    # whether it did. Blanking a cell the remaining clues force, as a naked
+    # or hidden single, can't add a solution, so a group of those needs no
+    # uniqueness check. Every other solution found on the way differs from
+    # ours in a set of cells, one of which must stay a clue, so a group
+    # that would blank the last clue of such a set is turned down without
+    # searching again
+    def _blank(self, group):
+        board = self.board
+        grid = board.grid
+        if any(all(not grid[index] or index in group for index in cells) for cells in self.unavoidable):
+            return False
+        values = [grid[index] for index in group]
+        forced = True
+        for index, value in zip(group, values):
+            board.set(index, 0)
+            forced = forced and board.forced(index, value)
+        if forced:
+            if stats.enabled:
+                stats.count('forced_blanks')
+            return True
+        if stats.enabled:
+            stats.count('uniqueness_checks')
+        solution = list(self.solution.grid)
+        for other in solutions(grid):
+            if other != solution:
+                self.unavoidable.append([index for index in range(81) if other[index] != solution[index]])
                 break
+        else:
+            return True
+        for index, value in zip(group, values):
+            board.set(index, value)
+        return False
 
     # Unused. Returns current state of generator including number of
     # empty cells and a representation of the puzzle
     def get_current_state(self):
         return (
-            f'There are currently {len(self.board.get_used_cells())} starting cells.\n\r'
+            f'There are currently {81 - self.board.grid.count(0)} starting cells.\n\r'
             f'Current puzzle state:\n\r\n\r{self.board.__str__()}\n\r'
         )
+
+
+# the solved board every puzzle starts from, read once per process
+@lru_cache(maxsize=None)
+def base_numbers():
+    with open(BASE_FILE) as f:
+        # reducing file to a list of numbers
+        numbers = filter(lambda x: x in '123456789', list(reduce(lambda x, y: x + y, f.readlines())))
+        return bytes(map(int, numbers))
+
+
+# how many clues a count is outside a (low, high) target by
+def _clue_miss(count, clues):
+    low, high = clues
+    return max(0, count - high, low - count)
+
+
+# a random order of the 9 rows (or columns) that keeps every band (or
+# stack) together
+def _random_line_order(rng):
+    order = []
+    for band in rng.sample(range(3), 3):
+        order.extend(band * 3 + line for line in rng.sample(range(3), 3))
+    return order
+
+
+# the seed puzzle k of a difficulty is generated from, given the seed of
+# the whole run. The attempt number tells apart the replacements of a
+# puzzle rejected as a duplicate. Seeds are signed 64-bit so they fit an
+# SQLite integer
+def puzzle_seed(seed, difficulty, k, attempt=0):
+    key = f'{seed}:{difficulty.name}:{k}:{attempt}'.encode()
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), 'big', signed=True)
+
+
+# builds a single puzzle from its own seed, inside a worker process or
+# not, so the result doesn't depend on where or in what order it's built.
+# The result is returned as bytes rather than a pickled Board/Cell graph,
+# along with the puzzle's canonical hash (if asked for), whatever the
+# worker's instrumentation recorded and what the puzzle was built from;
+# decode() turns it back into boards
+def generate_one(difficulty, seed, profile=False, unique=False, clues=None, symmetry='none'):
+    # the flag is put back afterwards, so a call in the main process
+    # doesn't turn the caller's profiling on or off
+    enabled, stats.enabled = stats.enabled, profile
+    try:
+        g = Generator(difficulty, random.Random(seed), clues, symmetry)
+        return (
+            g.board.to_bytes(),
+            g.solution.to_bytes(),
+            puzzle_hash(g.board.grid) if unique else None,
+            stats.drain() if profile else None,
+            seed,
+            clues,
+            symmetry,
+        )
+    finally:
+        stats.enabled = enabled
+
+
+# the puzzle numbers k of a difficulty that belong to shard i of n
+def shard_numbers(count, shard=(0, 1)):
+    i, n = shard
+    return range(i, count, n)
+
+
+# yields (board, solution, hash) records for each (difficulty, count) pair,
+# in the order requested, as soon as each one is ready. Puzzle k of each
+# difficulty is built from puzzle_seed(seed, difficulty, k), and its board
+# remembers that seed; without a seed a random one is used. With a shard
+# (i, n) only the puzzles with k % n == i are built, so n runs with the
+# same seed split a job between them without overlapping.
+# With a pool of worker processes at most `window` puzzles are in flight
+# at a time, so a slow consumer holds generation back instead of piling up
+# results. With unique set, every puzzle is hashed by its canonical form
+# and any puzzle equivalent to an earlier one, or whose hash is in `seen`,
+# is replaced by one built from the next attempt's seed; otherwise the
+# hash is None. clues and symmetry are passed on to every Generator
+def generate_iter(difficulty_counts, workers=1, window=None, unique=False, seen=(), seed=None, shard=(0, 1),
+                  clues=None, symmetry='none'):
+    if seed is None:
+        seed = random.getrandbits(64)
+    tasks = [
+        (d, puzzle_seed(seed, d, k), stats.enabled, unique, clues, symmetry)
+        for d, c in difficulty_counts for k in shard_numbers(c, shard)
+    ]
+    numbers = [k for _, c in difficulty_counts for k in shard_numbers(c, shard)]
+    hashes = set()
+
+    def accept(n, difficulty, result):
+        attempt = 0
+        while unique and (result[2] in hashes or result[2] in seen):
+            if stats.enabled:
+                stats.count('duplicates')
+            attempt += 1
+            result = generate_one(
+                difficulty, puzzle_seed(seed, difficulty, numbers[n], attempt), stats.enabled, unique, clues, symmetry
+            )
+        hashes.add(result[2])
+        return decode(difficulty, result)
+
+    if workers > 1 and len(tasks) > 1:
+        window = window or workers * 4
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for n, task in enumerate(tasks):
+                pending.append((n, task[0], executor.submit(generate_one, *task)))
+                if len(pending) >= window:
+                    n, difficulty, future = pending.popleft()
+                    yield accept(n, difficulty, future.result())
+            while pending:
+                n, difficulty, future = pending.popleft()
+                yield accept(n, difficulty, future.result())
+    else:
+        for n, task in enumerate(tasks):
+            yield accept(n, task[0], generate_one(*task))
+
+
+# turns a worker's result back into boards, keeping what it recorded
+def decode(difficulty, result):
+    board, solution, digest, recorded, seed, clues, symmetry = result
+    if recorded:
+        stats.merge(recorded)
+    return Board.from_bytes(board, difficulty, seed, clues, symmetry), Board.from_bytes(solution), digest
+
+
+# rebuilds a single puzzle from the seed, clue target and symmetry its
+# board remembers, without generating anything else. Returns a (board,
+# solution, hash) record
+def regenerate(difficulty, seed, unique=False, clues=None, symmetry='none'):
+    return decode(difficulty, generate_one(difficulty, seed, False, unique, clues, symmetry))
+
+
+# generates puzzles for each (difficulty, count) pair, optionally spread
+# across a pool of worker processes. Returns one list of (board, solution)
+# pairs per difficulty, in the order requested
+def generate(difficulty_counts, workers=1, unique=False, seed=None):
+    results = generate_iter(difficulty_counts, workers, unique=unique, seed=seed)
+    return [[(board, solution) for board, solution, _ in islice(results, c)] for _, c in difficulty_counts]
@@ -0,0 +1,172 @@
+from .grid import ALL, BIT, BOXES, COLUMNS, COUNT, DIGIT, PEERS, ROWS, UNITS
+
+# the technique ladder, easiest first, with the cost of each application.
+# A puzzle's score is the total cost of solving it by always applying the
+# easiest technique that makes progress
+TECHNIQUES = [
+    ('naked_single', 1),
+    ('hidden_single', 2),
+    ('locked_candidates', 8),
+    ('naked_pair', 15),
+    ('hidden_pair', 20),
+    ('x_wing', 40),
+]
+
+# added when the ladder gets stuck and the puzzle needs guessing
+STUCK_COST = 500
+
+# pairs of boxes/lines that intersect, with the 3 cells they share
+INTERSECTIONS = [
+    (box, line, [i for i in box if i in line])
+    for box in BOXES
+    for line in ROWS + COLUMNS
+    if len(set(box) & set(line)) == 3
+]
+
+
+class Grader:
+
+    # keeps the candidates of every cell of a puzzle as bitmasks
+    def __init__(self, grid):
+        self.grid = list(grid)
+        self.candidates = [0 if v else ALL for v in self.grid]
+        for i, value in enumerate(self.grid):
+            if value:
+                for p in PEERS[i]:
+                    self.candidates[p] &= ~BIT[value]
+
+    def place(self, i, value):
+        self.grid[i] = value
+        self.candidates[i] = 0
+        for p in PEERS[i]:
+            self.candidates[p] &= ~BIT[value]
+
+    # removes candidates from cells, returns whether anything changed
+    def eliminate(self, cells, mask):
+        changed = False
+        for i in cells:
+            if self.candidates[i] & mask:
+                self.candidates[i] &= ~mask
+                changed = True
+        return changed
+
+    def naked_single(self):
+        for i, candidates in enumerate(self.candidates):
+            if candidates and not candidates & (candidates - 1):
+                self.place(i, DIGIT[candidates])
+                return True
+        return False
+
+    def hidden_single(self):
+        for unit in UNITS:
+            once = twice = 0
+            for i in unit:
+                twice |= once & self.candidates[i]
+                once |= self.candidates[i]
+            hidden = once & ~twice
+            if hidden:
+                bit = hidden & -hidden
+                for i in unit:
+                    if self.candidates[i] & bit:
+                        self.place(i, DIGIT[bit])
+                        return True
+        return False
+
+    # pointing and claiming: when a digit's candidates in a box all lie on
+    # one line (or the other way round), it can be removed from the rest
+    # of that line (or box)
+    def locked_candidates(self):
+        for box, line, shared in INTERSECTIONS:
+            inside = 0
+            for i in shared:
+                inside |= self.candidates[i]
+            box_rest = line_rest = 0
+            for i in box:
+                if i not in shared:
+                    box_rest |= self.candidates[i]
+            for i in line:
+                if i not in shared:
+                    line_rest |= self.candidates[i]
+            pointing = inside & ~box_rest
+            if pointing and self.eliminate([i for i in line if i not in shared], pointing):
+                return True
+            claiming = inside & ~line_rest
+            if claiming and self.eliminate([i for i in box if i not in shared], claiming):
+                return True
+        return False
+
+    # two cells of a unit with the same two candidates take both digits
+    def naked_pair(self):
+        for unit in UNITS:
+            pairs = [i for i in unit if COUNT[self.candidates[i]] == 2]
+            for a in range(len(pairs)):
+                for b in range(a + 1, len(pairs)):
+                    mask = self.candidates[pairs[a]]
+                    if mask == self.candidates[pairs[b]]:
+                        others = [i for i in unit if i != pairs[a] and i != pairs[b]]
+                        if self.eliminate(others, mask):
+                            return True
+        return False
+
+    # two digits confined to the same two cells of a unit rule out every
+    # other candidate of those cells
+    def hidden_pair(self):
+        for unit in UNITS:
+            places = {}
+            for d in range(1, 10):
+                cells = tuple(i for i in unit if self.candidates[i] & BIT[d])
+                if len(cells) == 2:
+                    places.setdefault(cells, []).append(d)
+            for cells, digits in places.items():
+                if len(digits) == 2:
+                    mask = BIT[digits[0]] | BIT[digits[1]]
+                    if any(self.candidates[i] & ~mask for i in cells):
+                        for i in cells:
+                            self.candidates[i] &= mask
+                        return True
+        return False
+
+    # a digit confined to the same two columns in two rows can be removed
+    # from the rest of those columns, and the same with rows and columns
+    # swapped
+    def x_wing(self):
+        for lines, crosses in ((ROWS, COLUMNS), (COLUMNS, ROWS)):
+            for d in range(1, 10):
+                bit = BIT[d]
+                spots = {}
+                for n, line in enumerate(lines):
+                    positions = tuple(k for k, i in enumerate(line) if self.candidates[i] & bit)
+                    if len(positions) == 2:
+                        spots.setdefault(positions, []).append(n)
+                for positions, found in spots.items():
+                    if len(found) == 2:
+                        for k in positions:
+                            others = [i for n, i in enumerate(crosses[k]) if n not in found]
+                            if self.eliminate(others, bit):
+                                return True
+        return False
+
+    # solves with the ladder and returns the score and how often each
+    # technique was applied
+    def grade(self):
+        score = 0
+        used = {}
+        while 0 in self.grid:
+            if any(not c for i, c in enumerate(self.candidates) if not self.grid[i]):
+                break
+            for name, cost in TECHNIQUES:
+                if getattr(self, name)():
+                    score += cost
+                    used[name] = used.get(name, 0) + 1
+                    break
+            else:
+                break
+        if 0 in self.grid:
+            score += STUCK_COST
+            used['stuck'] = 1
+        return score, used
+
+
+# the score of a puzzle
+def score(grid):
+    return Grader(bytes(grid)).grade()[0]
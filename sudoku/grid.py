@@ -0,0 +1,46 @@
+# precomputed index tables for a flat, row-major 81-cell grid
+
+# unit index of each cell
+ROW_OF = [i // 9 for i in range(81)]
+COL_OF = [i % 9 for i in range(81)]
+BOX_OF = [3 * (i // 27) + (i % 9) // 3 for i in range(81)]
+
+# cell indices belonging to each unit
+ROWS = [[r * 9 + c for c in range(9)] for r in range(9)]
+COLUMNS = [[r * 9 + c for r in range(9)] for c in range(9)]
+BOXES = [[i for i in range(81) if BOX_OF[i] == b] for b in range(9)]
+UNITS = ROWS + COLUMNS + BOXES
+
+# the 20 cells sharing a row, column or box with each cell
+PEERS = [
+    sorted(set(ROWS[ROW_OF[i]] + COLUMNS[COL_OF[i]] + BOXES[BOX_OF[i]]) - {i})
+    for i in range(81)
+]
+
+# candidate bitmasks, bit (d - 1) stands for digit d
+ALL = 0x1FF
+BIT = [0] + [1 << (d - 1) for d in range(1, 10)]
+DIGIT = {1 << (d - 1): d for d in range(1, 10)}
+COUNT = [bin(m).count('1') for m in range(ALL + 1)]
+DIGITS_OF = [[d for d in range(1, 10) if m & BIT[d]] for m in range(ALL + 1)]
+
+# the row, column and box of each cell as indices into a 27-entry list of
+# units (rows first, then columns, then boxes)
+UNITS_OF = [(ROW_OF[i], 9 + COL_OF[i], 18 + BOX_OF[i]) for i in range(81)]
+
+# the 3-cell row segment (row within a box) and column segment (column
+# within a box) each cell belongs to
+ROW_SEGMENT_OF = [ROW_OF[i] * 3 + COL_OF[i] // 3 for i in range(81)]
+COL_SEGMENT_OF = [COL_OF[i] * 3 + ROW_OF[i] // 3 for i in range(81)]
+
+# groups of cells that a symmetry of the clue pattern maps onto each other:
+# none, a half turn about the center, or a mirror about the middle column
+SYMMETRIES = {
+    'none': [(i,) for i in range(81)],
+    'rotational': sorted({tuple(sorted({i, 80 - i})) for i in range(81)}),
+    'mirror': sorted({tuple(sorted({i, ROW_OF[i] * 9 + 8 - COL_OF[i]})) for i in range(81)}),
+}
+
+# the fewest clues the generator reliably reaches with each symmetry; lower
+# targets are refused rather than missed
+MIN_CLUES = {'none': 24, 'rotational': 28, 'mirror': 28}
@@ -0,0 +1,89 @@
+from math import ceil
+
+from exceptions import ConfigurationError
+
+# space between the grids of a multi-up page, in cells
+GAP = 1
+
+# height of one grid with its labels, in cells: the number above it, the
+# 9 rows and the caption below
+SLOT_HEIGHT = 10.75
+
+
+# columns and rows of grids for n grids per page
+def arrangement(n):
+    columns = 1 if n <= 2 else 2 if n <= 6 else 3
+    return columns, ceil(n / columns)
+
+
+class Layout:
+
+    # page geometry for a trim size and margins, all in inches. The left
+    # margin is the outer one on pages with a left side gutter and the
+    # inner one on the others; a full-page grid spans the width between
+    # the margins, unless its labels would then run past the footer, and
+    # starts `top` inches down. The footer sits `bottom` inches above the
+    # bottom edge. Geometry is worked out once per gutter side and grid
+    # count, and reused for every later page
+    def __init__(self, width=6, height=9, inner=.9, outer=.55, top=1.5, bottom=1.5):
+        self.width = width
+        self.height = height
+        self.inner = inner
+        self.outer = outer
+        self.top = top
+        self.bottom = bottom
+        text_width = width - inner - outer
+        text_height = height - top - bottom
+        if text_width <= 0 or text_height <= 0:
+            raise ConfigurationError(
+                f'Margins leave no room for a grid on a {width:g}x{height:g} page '
+                f'({text_width:g} inches wide, {text_height:g} inches tall).'
+            )
+        # the grid and its caption, below `top`, must fit above the footer
+        self.cell_size = min(text_width / 9, text_height / (SLOT_HEIGHT - 1))
+        self.grid_size = self.cell_size * 9
+        self.sides = {}
+
+    # a dict with the page's left offset and x center, and the grid
+    # positions for every grid count asked for so far
+    def side(self, left_side_gutter):
+        if left_side_gutter not in self.sides:
+            left = self.outer if left_side_gutter else self.inner
+            self.sides[left_side_gutter] = {
+                'left': left,
+                'x_center': left + self.grid_size / 2 + self.cell_size * .05,
+                'slots': {},
+            }
+        return self.sides[left_side_gutter]
+
+    # the (x, y, cell size) of the top left corner of each grid on a page
+    # holding n of them. One grid fills the page as it always has; more are
+    # shrunk to fit the area from the first grid's number label down to the
+    # footer, in rows of up to 3 columns
+    def slots(self, left_side_gutter, n):
+        if n < 1:
+            raise ConfigurationError(f'Expected at least 1 grid per page, got {n}.')
+        side = self.side(left_side_gutter)
+        if n not in side['slots']:
+            left = side['left']
+            if n == 1:
+                side['slots'][n] = [(left, self.top, self.cell_size)]
+            else:
+                columns, rows = arrangement(n)
+                area_top = self.top - self.cell_size
+                area_height = self.height - self.bottom - area_top
+                cell = min(
+                    self.grid_size / (9 * columns + GAP * (columns - 1)),
+                    area_height / (SLOT_HEIGHT * rows + GAP * (rows - 1)),
+                )
+                # centered horizontally in the width of a full-page grid
+                x = left + (self.grid_size - cell * (9 * columns + GAP * (columns - 1))) / 2
+                side['slots'][n] = [
+                    (
+                        x + c * cell * (9 + GAP),
+                        area_top + cell + r * cell * (SLOT_HEIGHT + GAP),
+                        cell,
+                    )
+                    for r in range(rows) for c in range(columns)
+                ][:n]
+        return side['slots'][n]
@@ -1,26 +1,66 @@
+import os
+import queue
 import subprocess
+import tempfile
+import threading
+import zlib
 from datetime import datetime
+from uuid import uuid4
+from itertools import chain, islice
+from math import ceil
 from fpdf import FPDF
+from sudoku import batch, stats
 from sudoku.difficulty import difficulties
-from sudoku.generator import Generator as SudokuGenerator
-from exceptions import ConfigurationError
-from utils import batched, flatten_pdf, copy_to_clipboard
+from sudoku.generator import generate_iter
+from sudoku.bank import PuzzleBank
+from sudoku.layout import Layout
+from exceptions import ConfigurationError, ValidationError
+from utils import Flattener, batched, concatenate_pdfs, flatten_pdf, copy_to_clipboard
 
 DEFAULT_COUNT = 1
 
 class SudokuPDF(FPDF):
 
-    def __init__(self, *args, easy=0, medium=0, hard=0, expert=0, **kwargs):
+    def __init__(self, *args, easy=0, medium=0, hard=0, expert=0, workers=1, from_bank=None, threads=1,
+                 pipeline=False, chunk_pages=20, unique=False, published=None, seed=None, stock=None,
+                 clipboard=True, inner_margin=.9, outer_margin=.55, puzzles_per_page=1, solutions_per_page=4,
+                 layout=None, flatten='vector', page_offset=0, clues=None, symmetry='none', **kwargs):
         if [d.name for d in difficulties] != ['Easy', 'Medium', 'Hard', 'Expert']:
             raise ConfigurationError('Invalid difficulty options.')
+        if puzzles_per_page < 1 or solutions_per_page < 1:
+            raise ConfigurationError('At least one puzzle and one solution must fit on a page.')
 
         self.difficulty_counts = [easy, medium, hard, expert]
+        self.workers = workers
+        self.from_bank = from_bank
+        self.threads = threads
+        self.pipeline = pipeline
+        self.chunk_pages = chunk_pages
+        self.unique = unique or bool(published)
+        self.published = published
+        self.seed = seed
+        self.clues = clues
+        self.symmetry = symmetry
+        # something to draw ready-made puzzles from, like a PuzzleBank
+        self.stock = stock
+        self.clipboard = clipboard
+        self.flatten = flatten
+        self.puzzles_per_page = puzzles_per_page
+        self.solutions_per_page = solutions_per_page
+        # number of book pages preceding this document, when it only holds
+        # one chunk of a pipelined build
+        self.page_offset = page_offset
+        self.fpdf_args = (args, kwargs)
         self.table_of_contents = True
         self.owner_page = True
+        self.grid_templates = {}
         super().__init__(*args, **kwargs)
+        # the page geometry, shared with the part documents of a pipelined
+        # build
+        self.layout = layout or Layout(self.w, self.h, inner_margin, outer_margin)
 
     def page_no(self):
-        return super().page_no() - int(self.owner_page) - int(self.table_of_contents)
+        return super().page_no() + self.page_offset - int(self.owner_page) - int(self.table_of_contents)
 
     @property
     def left_side_gutter(self):
@@ -28,23 +68,23 @@ class SudokuPDF(FPDF):
 
     @property
     def left_offset(self):
-        return .55 if self.left_side_gutter else .9
+        return self.layout.side(self.left_side_gutter)['left']
 
     @property
     def right_offset(self):
-        return 5.45 if self.left_side_gutter else 5.1
+        return self.left_offset + self.grid_size
 
     @property
     def x_center(self):
-        return 2.825 if self.left_side_gutter else 3.175
+        return self.layout.side(self.left_side_gutter)['x_center']
 
     @property
     def top_offset(self):
-        return 1.5
+        return self.layout.top
 
     @property
     def cell_size(self):
-        return self.w / 12
+        return self.layout.cell_size
 
     @property
     def section_size(self):
@@ -58,13 +98,13 @@ class SudokuPDF(FPDF):
         if self.page_no() >= 1:
             self.set_font('Montserrat', size=12)
             page_no = str(self.page_no())
-            self.set_xy(self.x_center - self.get_string_width(page_no), -1.5)
+            self.set_xy(self.x_center - self.get_string_width(page_no), -self.layout.bottom)
             self.cell(1, 1, page_no, 0, 0, 'L')
 
     def draw_owner_page(self):
         self.add_page()
         line_width = 2.69
-        left_offset = 1.655
+        left_offset = (self.w - line_width) / 2
         top_offset = 2
         cell_height = 0.25
         line_distance = .75
@@ -86,12 +126,13 @@ class SudokuPDF(FPDF):
         line_height = 1
         self.set_font('Montserrat', size=24)
         page_no = 1
-        for difficulty, count in [*zip([d.name for d in difficulties], self.difficulty_counts), ('Solutions', 1)]:
-            if count > 0:
+        chapters = [(d.name, ceil(c / self.puzzles_per_page)) for d, c in zip(difficulties, self.difficulty_counts)]
+        for difficulty, pages in [*chapters, ('Solutions', 1)]:
+            if pages > 0:
                 self.set_xy(self.left_offset, top_offset)
                 self.cell(self.left_offset, 0, f'{page_no} · {difficulty.upper()}', 0, 1, 'L')
                 top_offset += line_height
-                page_no += count + 1
+                page_no += pages + 1
 
     def draw_chapter_page(self, title):
         self.add_page()
@@ -100,53 +141,144 @@ class SudokuPDF(FPDF):
         self.set_xy(self.left_offset, 4)
         self.cell(self.left_offset, 0, title.upper(), 0, 1, 'L')
 
-    def draw_boards(self, boards):
+    # draws a page of (board, puzzle number) grids, laid out for per_page
+    # of them
+    def draw_grid_page(self, grids, per_page=1):
+        self.add_page()
+        for (board, puzzle_no), (x, y, cell_size) in zip(grids, self.layout.slots(self.left_side_gutter, per_page)):
+            self.draw_sudoku_grid(board, puzzle_no, x, y, cell_size)
+
+    # The book is laid out as a sequence of pages, each given as a
+    # (method, args) pair that draws exactly one page. Describing the pages
+    # this way lets the same sequence be drawn into one document or split
+    # into chunks, and lets the boards arrive lazily.
+
+    def front_pages(self):
+        yield SudokuPDF.draw_owner_page, ()
+        yield SudokuPDF.add_page, ()  # Blank page so that both owner * ToC are on the right side
+        yield SudokuPDF.draw_table_of_contents, ()
+
+    # the puzzle pages for a flat sequence of boards, split into chapters
+    # by the number of boards of each difficulty
+    def board_pages(self, boards, counts):
+        boards = iter(boards)
         puzzle_no = 1
-        for difficulty, batch in zip(difficulties, boards):
-            if not batch:
+        for difficulty, count in zip(difficulties, counts):
+            if not count:
                 continue
 
-            self.draw_chapter_page(difficulty.name)
-            for board in batch:
-                self.add_page()
-                self.draw_sudoku_grid(board, puzzle_no)
-                puzzle_no += 1
+            yield SudokuPDF.draw_chapter_page, (difficulty.name,)
+            for group in batched(islice(boards, count), self.puzzles_per_page):
+                grids = [(board, puzzle_no + n) for n, board in enumerate(group)]
+                yield SudokuPDF.draw_grid_page, (grids, self.puzzles_per_page)
+                puzzle_no += len(group)
+
+    def solution_pages(self, solutions):
+        yield SudokuPDF.draw_chapter_page, ('Solutions',)
+        puzzle_no = 1
+        for group in batched(solutions, self.solutions_per_page):
+            grids = [(solution, puzzle_no + n) for n, solution in enumerate(group)]
+            yield SudokuPDF.draw_grid_page, (grids, self.solutions_per_page)
+            puzzle_no += len(group)
+
+    def draw_pages(self, pages):
+        for method, args in pages:
+            method(self, *args)
+
+    def draw_boards(self, boards):
+        self.draw_pages(self.board_pages(chain(*boards), [len(batch) for batch in boards]))
 
     def draw_solutions(self, solutions):
-        self.draw_chapter_page('Solutions')
-        for batch in batched(list(enumerate(solutions, 1)), 4):
-            for puzzle_no, solution in batch:
-                self.add_page()
-                self.draw_sudoku_grid(solution, puzzle_no)
+        self.draw_pages(self.solution_pages(solutions))
 
-    def draw_sudoku_grid(self, board, puzzle_no):
-        self.set_font('Montserrat', size=24)
+    # draws a grid with its top left corner at (left_offset, top_offset) and
+    # cells cell_size wide, the full-page grid by default. Smaller grids get
+    # proportionally smaller text
+    def draw_sudoku_grid(self, board, puzzle_no, left_offset=None, top_offset=None, cell_size=None):
+        left_offset = self.left_offset if left_offset is None else left_offset
+        top_offset = self.top_offset if top_offset is None else top_offset
+        cell_size = cell_size or self.cell_size
+        scale = cell_size / self.cell_size
+
+        self.set_font('Montserrat', size=24 * scale)
         self.set_line_width(0.001)
-        self.set_xy(self.left_offset, 1)
-        self.cell(self.left_offset, 0, f'No. {puzzle_no}', 0, 1, 'L')
+        self.set_xy(left_offset, top_offset - cell_size)
+        self.cell(left_offset, 0, f'No. {puzzle_no}', 0, 1, 'L')
         self.ln()
 
-        # Draw the grid cells
-        self.set_font('NunitoLight', size=16)
+        # Place the empty grid, then write only the digits
+        self.draw_grid_template(left_offset, top_offset, scale)
+        self.set_font('NunitoLight', size=16 * scale)
         grid = board.values
         for i in range(9):
             for j in range(9):
-                x = j * self.cell_size + self.left_offset
-                y = i * self.cell_size + self.top_offset
-                self.set_xy(x, y)
-                self.cell(self.cell_size, self.cell_size, str(grid[i][j]), border=1, align='C')
-
-        # Draw thick borders
-        self.set_line_width(0.05)
-        self.rect(self.left_offset, self.top_offset, self.grid_size, self.grid_size)
-        self.set_line_width(0.025)
-        self.rect(self.left_offset, self.top_offset + self.section_size, self.grid_size, self.section_size)
-        self.rect(self.left_offset + self.section_size, self.top_offset, self.section_size, self.grid_size)
+                if grid[i][j]:
+                    self.set_xy(j * cell_size + left_offset, i * cell_size + top_offset)
+                    self.cell(cell_size, cell_size, str(grid[i][j]), align='C')
 
         self.set_font('Montserrat')
-        self.set_xy(self.left_offset, self.top_offset + self.grid_size + self.cell_size * .25)
+        self.set_xy(left_offset, top_offset + cell_size * 9.25)
         text = board.difficulty.name.upper() if board.difficulty else 'Solution'
-        self.cell(0, self.cell_size * .5, txt=text)
+        self.cell(0, cell_size * .5, txt=text)
+
+    # places the empty grid (thin cell lines plus thick box borders) on the
+    # page. The full-page grid is drawn once per gutter side into a form
+    # XObject and every later page only references it; grids placed
+    # elsewhere or smaller reuse it through a scale and translate matrix
+    def draw_grid_template(self, left_offset, top_offset, scale=1):
+        if self.left_offset not in self.grid_templates:
+            index = len(self.grid_templates) + 1
+            self.grid_templates[self.left_offset] = {'i': index, 'n': None, 'content': self.grid_template_content()}
+        name = f'/TPL{self.grid_templates[self.left_offset]["i"]} Do'
+        if (left_offset, top_offset, scale) == (self.left_offset, self.top_offset, 1):
+            self._out(name)
+        else:
+            k, h = self.k, self.h
+            e = (left_offset - scale * self.left_offset) * k
+            f = ((h - top_offset) - scale * (h - self.top_offset)) * k
+            self._out('q %.4f 0 0 %.4f %.2f %.2f cm %s Q' % (scale, scale, e, f, name))
+
+    # PDF drawing operators for the empty grid at the current offsets
+    def grid_template_content(self):
+        k, h = self.k, self.h
+        left, top = self.left_offset, self.top_offset
+        cell_size, section_size, grid_size = self.cell_size, self.section_size, self.grid_size
+
+        def line(x1, y1, x2, y2):
+            return '%.2f %.2f m %.2f %.2f l S' % (x1 * k, (h - y1) * k, x2 * k, (h - y2) * k)
+
+        def rect(x, y, w, hh):
+            return '%.2f %.2f %.2f %.2f re S' % (x * k, (h - y) * k, w * k, -hh * k)
+
+        ops = ['%.2f w' % (0.001 * k)]
+        for i in range(10):
+            ops.append(line(left, top + i * cell_size, left + grid_size, top + i * cell_size))
+            ops.append(line(left + i * cell_size, top, left + i * cell_size, top + grid_size))
+        ops.append('%.2f w' % (0.05 * k))
+        ops.append(rect(left, top, grid_size, grid_size))
+        ops.append('%.2f w' % (0.025 * k))
+        ops.append(rect(left, top + section_size, grid_size, section_size))
+        ops.append(rect(left + section_size, top, section_size, grid_size))
+        return '\n'.join(ops)
+
+    # writes the grid templates alongside the images
+    def _putimages(self):
+        super()._putimages()
+        for template in self.grid_templates.values():
+            content = template['content'].encode('latin1')
+            if self.compress:
+                content = zlib.compress(content)
+            self._newobj()
+            self._out('<</Type /XObject /Subtype /Form /BBox [0 0 %.2f %.2f] %s/Length %d>>' % (
+                self.w * self.k, self.h * self.k, '/Filter /FlateDecode ' if self.compress else '', len(content)))
+            self._putstream(content)
+            self._out('endobj')
+            template['n'] = self.n
+
+    def _putxobjectdict(self):
+        super()._putxobjectdict()
+        for template in self.grid_templates.values():
+            self._out(f'/TPL{template["i"]} {template["n"]} 0 R')
 
     def setup_fonts(self):
         self.add_font('NunitoLight', '', 'fonts/Nunito/static/Nunito-Light.ttf', uni=True)
@@ -154,21 +286,167 @@ class SudokuPDF(FPDF):
 
     def create_pdf(self):
         filename = datetime.now().strftime(f'sudoku-grids/sudoku-{"_".join([str(c) for c in self.difficulty_counts])}-%b%e-%H_%M_%S-%Y')
+        # builds started within the same second, e.g. by the build service,
+        # each get their own files
+        filename += f'-{uuid4().hex[:8]}'
         filepath = f'{filename}.pdf'
-        filepath_flat = f'{filename}-flat.pdf'
+        # without a flatten backend the book is only drawn
+        filepath_flat = f'{filename}-flat.pdf' if self.flatten else None
         self.setup_fonts()
 
+        # puzzles already published in earlier books are rejected, and this
+        # book's puzzles are recorded once it's been built
+        published = PuzzleBank(self.published) if self.published else None
+        if self.pipeline and self.flatten:
+            hashes = self.create_pdf_pipelined(filepath, filepath_flat, published)
+        else:
+            hashes = self.create_pdf_phased(filepath, filepath_flat, published)
+        if published:
+            published.publish(hashes)
+            published.close()
+        if self.clipboard:
+            copy_to_clipboard(filepath_flat or filepath)
+        return filepath, filepath_flat
+
+    # the (board, solution, hash) records to draw, from the stock, the bank
+    # or freshly generated
+    def puzzles(self, published=None):
+        difficulty_counts = list(zip(difficulties, self.difficulty_counts))
+        if self.stock:
+            return chain(*self.stock.draw(difficulty_counts))
+        if self.from_bank:
+            bank = PuzzleBank(self.from_bank)
+            generated = bank.draw(difficulty_counts)
+            bank.close()
+            return chain(*generated)
+        return generate_iter(
+            difficulty_counts, self.workers, unique=self.unique, seen=published or (), seed=self.seed,
+            clues=self.clues, symmetry=self.symmetry,
+        )
+
+    # generates every puzzle, then draws every page, then writes and
+    # flattens. Returns the puzzles' hashes
+    def create_pdf_phased(self, filepath, filepath_flat, published=None):
         # Generate puzzles
-        generators = [[SudokuGenerator(d) for _ in range(c)] for d, c in zip(difficulties, self.difficulty_counts)]
-        boards = [[g.board for g in batch] for batch in generators]
-        solutions = [g.solution for batch in generators for g in batch]
-
-        self.draw_owner_page()
-        self.add_page() # Blank page so that both owner * ToC are on the right side
-        self.draw_table_of_contents()
-        self.draw_boards(boards)
-        self.draw_solutions(solutions)
-
-        self.output(filepath)
-        flatten_pdf(filepath, filepath_flat)
-        copy_to_clipboard(filepath_flat)
+        with stats.timer('generate', 'Book'):
+            generated = list(self.puzzles(published))
+        boards = [board for board, _, _ in generated]
+        solutions = [solution for _, solution, _ in generated]
+        self.check_solutions(boards, solutions)
+
+        with stats.timer('draw', 'Book'):
+            self.draw_pages(chain(
+                self.front_pages(), self.board_pages(boards, self.difficulty_counts), self.solution_pages(solutions)
+            ))
+
+        with stats.timer('output', 'Book'):
+            self.output(filepath)
+        if filepath_flat:
+            with stats.timer('flatten', 'Book'):
+                flatten_pdf(filepath, filepath_flat, thread_count=self.threads, backend=self.flatten)
+        return [digest for _, _, digest in generated]
+
+    # draws pages while puzzles are still being generated. Every chunk_pages
+    # pages are written out as a separate part document (offset so that its
+    # page numbers and gutters match the book) and handed to a background
+    # thread that flattens the parts in order into one flattened PDF,
+    # written once every part is in. The bounded queue holds the
+    # drawing back when flattening falls behind, and the puzzle iterator
+    # does the same for generation. The unflattened PDF is the parts
+    # joined together at the end, so no page is drawn twice. Returns the
+    # puzzles' hashes
+    def create_pdf_pipelined(self, filepath, filepath_flat, published=None):
+        boards, solutions, hashes = [], [], []
+
+        def boards_as_generated():
+            for board, solution, digest in self.puzzles(published):
+                boards.append(board)
+                solutions.append(solution)
+                hashes.append(digest)
+                yield board
+
+        pages = chain(
+            self.front_pages(),
+            self.board_pages(boards_as_generated(), self.difficulty_counts),
+            self.solution_pages(solutions),
+        )
+
+        parts = queue.Queue(maxsize=2)
+        failures = []
+
+        def flatten_parts():
+            flattener = Flattener(filepath_flat, thread_count=self.threads, backend=self.flatten)
+            while (path := parts.get()) is not None:
+                if not failures:
+                    try:
+                        flattener.add(path)
+                    except Exception as e:
+                        failures.append(e)
+            if not failures:
+                try:
+                    flattener.close()
+                except Exception as e:
+                    failures.append(e)
+            # no print file is left behind for a book that failed
+            if failures and os.path.exists(filepath_flat):
+                os.remove(filepath_flat)
+
+        flattener = threading.Thread(target=flatten_parts)
+        flattener.start()
+        with tempfile.TemporaryDirectory() as folder:
+            paths = []
+            try:
+                offset = checked = 0
+                for n, chunk in enumerate(batched(pages, self.chunk_pages)):
+                    with stats.timer('generate+draw', 'Book'):
+                        part = self.part(offset)
+                        part.draw_pages(chunk)
+                        path = os.path.join(folder, f'part-{n}.pdf')
+                        part.output(path)
+                    offset += part.page
+                    # the puzzles generated for this part are checked
+                    # before any of it goes to the flattener
+                    self.check_solutions(boards[checked:], solutions[checked:], checked + 1)
+                    checked = len(boards)
+                    paths.append(path)
+                    # a part the flattener failed on stops the build here,
+                    # rather than once every page is drawn
+                    if failures:
+                        break
+                    parts.put(path)
+            except Exception as e:
+                failures.append(e)
+                raise
+            finally:
+                parts.put(None)
+                with stats.timer('flatten', 'Book'):
+                    flattener.join()
+            if failures:
+                raise failures[0]
+
+            with stats.timer('output', 'Book'):
+                concatenate_pdfs(paths, filepath)
+        return hashes
+
+    # checks solutions against their puzzles in one batch, numbering the
+    # puzzles from `first`
+    def check_solutions(self, boards, solutions, first=1):
+        if not boards:
+            return
+        with stats.timer('check', 'Book'):
+            ok = batch.check_solutions(batch.to_array(boards), batch.to_array(solutions))
+        if not ok.all():
+            numbers = ', '.join(str(n) for n in (~ok).nonzero()[0] + first)
+            raise ValidationError(f'Puzzles with an invalid solution: {numbers}')
+
+    # a document for one chunk of a pipelined build, starting after the
+    # given number of book pages
+    def part(self, page_offset):
+        args, kwargs = self.fpdf_args
+        counts = dict(zip([d.name.lower() for d in difficulties], self.difficulty_counts))
+        part = SudokuPDF(
+            *args, layout=self.layout, puzzles_per_page=self.puzzles_per_page,
+            solutions_per_page=self.solutions_per_page, page_offset=page_offset, **counts, **kwargs
+        )
+        part.setup_fonts()
+        return part
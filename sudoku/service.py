@@ -0,0 +1,181 @@
+import json
+import random
+import threading
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .difficulty import difficulties
+from .generator import base_numbers, decode, generate_one, puzzle_seed
+from .pdf import SudokuPDF
+
+
+class PuzzleStock:
+
+    # keeps up to `size` ready puzzles of every difficulty, topped up in
+    # the background by one thread per difficulty feeding a shared pool of
+    # worker processes. Puzzle k of a difficulty is built from
+    # puzzle_seed(seed, difficulty, k), counting from the start of the
+    # service. With unique set, a puzzle equivalent to any other handed out
+    # or in stock is dropped. clues and symmetry are passed on to every
+    # Generator. If a difficulty's puzzles fail to generate, e.g. because
+    # the pool broke, its thread stops and draw() raises once its stock
+    # runs out
+    def __init__(self, executor, size=50, seed=None, unique=False, clues=None, symmetry='none'):
+        self.executor = executor
+        self.size = size
+        self.seed = random.getrandbits(63) if seed is None else seed
+        self.unique = unique
+        self.clues = clues
+        self.symmetry = symmetry
+        self.buffers = {d.name: deque() for d in difficulties}
+        self.hashes = set()
+        self.errors = {}
+        self.closed = False
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self.fill, args=(d,), daemon=True) for d in difficulties]
+        for thread in self.threads:
+            thread.start()
+
+    def fill(self, difficulty):
+        try:
+            self._fill(difficulty)
+        except CancelledError:
+            pass
+        except Exception as e:
+            with self.condition:
+                self.errors[difficulty.name] = e
+                self.condition.notify_all()
+
+    def _fill(self, difficulty):
+        buffer = self.buffers[difficulty.name]
+        pending = deque()
+        k = 0
+        while True:
+            with self.condition:
+                while not self.closed and len(buffer) + len(pending) < self.size:
+                    pending.append(self.executor.submit(
+                        generate_one, difficulty, puzzle_seed(self.seed, difficulty, k), unique=self.unique,
+                        clues=self.clues, symmetry=self.symmetry,
+                    ))
+                    k += 1
+                if not pending:
+                    self.condition.wait_for(lambda: self.closed or len(buffer) < self.size)
+                if self.closed:
+                    return
+                if not pending:
+                    continue
+            record = decode(difficulty, pending.popleft().result())
+            with self.condition:
+                if not (self.unique and record[2] in self.hashes):
+                    self.hashes.add(record[2])
+                    buffer.append(record)
+                self.condition.notify_all()
+
+    # number of ready puzzles, per difficulty name
+    def levels(self):
+        with self.condition:
+            return {name: len(buffer) for name, buffer in self.buffers.items()}
+
+    # takes puzzles for each (difficulty, count) pair out of the stock,
+    # waiting for the background threads when there aren't enough yet.
+    # Returns one list of (board, solution, hash) records per difficulty,
+    # like PuzzleBank.draw(). Raises a RuntimeError, putting back what it
+    # took, if a difficulty runs out after its thread failed
+    def draw(self, difficulty_counts):
+        batches = []
+        for difficulty, count in difficulty_counts:
+            buffer = self.buffers[difficulty.name]
+            records = []
+            batches.append(records)
+            while len(records) < count:
+                with self.condition:
+                    self.condition.wait_for(lambda: buffer or difficulty.name in self.errors)
+                    if not buffer:
+                        for (d, _), taken in zip(difficulty_counts, batches):
+                            self.buffers[d.name].extendleft(reversed(taken))
+                        error = self.errors[difficulty.name]
+                        raise RuntimeError(
+                            f'{difficulty.name} puzzles can no longer be generated: {type(error).__name__}: {error}'
+                        ) from error
+                    while buffer and len(records) < count:
+                        records.append(buffer.popleft())
+                    self.condition.notify_all()
+        return batches
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class BuildHandler(BaseHTTPRequestHandler):
+
+    # GET /stock        the number of ready puzzles per difficulty
+    # POST /build       builds a book; the JSON body holds the puzzle count
+    #                   per difficulty plus any of the build options below,
+    #                   e.g. {"easy": 50, "expert": 50, "trim": [6, 9]}.
+    #                   Answers with the paths of the PDF and its
+    #                   flattened copy
+    options = (
+        'threads', 'pipeline', 'chunk_pages', 'flatten', 'trim', 'inner_margin', 'outer_margin',
+        'puzzles_per_page', 'solutions_per_page',
+    )
+
+    def do_GET(self):
+        if self.path == '/stock':
+            self.reply(200, self.server.stock.levels())
+        else:
+            self.reply(404, {'error': f'Unknown path {self.path}.'})
+
+    def do_POST(self):
+        if self.path != '/build':
+            return self.reply(404, {'error': f'Unknown path {self.path}.'})
+        names = [d.name.lower() for d in difficulties]
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+            if not isinstance(request, dict):
+                raise ValueError('Expected a JSON object.')
+            unknown = set(request) - set(names) - set(self.options)
+            if unknown:
+                raise ValueError(f'Unknown options: {", ".join(sorted(unknown))}.')
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+
+        # one build at a time; the stock keeps filling meanwhile
+        with self.server.build_lock:
+            try:
+                trim = tuple(request.pop('trim', (6, 9)))
+                pdf = SudokuPDF(unit='in', format=trim, stock=self.server.stock, clipboard=False, **request)
+                filepath, filepath_flat = pdf.create_pdf()
+            except Exception as e:
+                return self.reply(500, {'error': f'{type(e).__name__}: {e}'})
+        self.reply(200, {'pdf': filepath, 'flat': filepath_flat})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# runs the build service until interrupted. The worker processes are
+# started once and keep base.txt loaded, so requests only pay for drawing
+# and flattening their pages
+def serve(host='127.0.0.1', port=8765, workers=1, buffer=50, seed=None, unique=False, clues=None, symmetry='none'):
+    with ProcessPoolExecutor(max_workers=workers, initializer=base_numbers) as executor:
+        stock = PuzzleStock(executor, buffer, seed, unique, clues, symmetry)
+        server = ThreadingHTTPServer((host, port), BuildHandler)
+        server.stock = stock
+        server.build_lock = threading.Lock()
+        print(f'Serving on http://{host}:{port} (seed {stock.seed})')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            stock.close()
+            executor.shutdown(cancel_futures=True)
@@ -1,3 +1,134 @@
+from . import stats
+from .grid import ALL, BIT, BOX_OF, COL_OF, COUNT, DIGIT, ROW_OF, UNITS
+
+
+# builds the search state for a flat 81-int grid: the grid itself plus
+# bitmasks of the digits already used in each row, column and box.
+# returns None if two givens clash
+def _state(grid):
+    grid = list(grid)
+    rows, cols, boxes = [0] * 9, [0] * 9, [0] * 9
+    for i, value in enumerate(grid):
+        if value:
+            bit = BIT[value]
+            r, c, b = ROW_OF[i], COL_OF[i], BOX_OF[i]
+            if (rows[r] | cols[c] | boxes[b]) & bit:
+                return None
+            rows[r] |= bit
+            cols[c] |= bit
+            boxes[b] |= bit
+    return grid, rows, cols, boxes
+
+
+# fills in naked and hidden singles until neither applies anymore,
+# returns False as soon as the grid is found to be contradictory
+def _propagate(grid, rows, cols, boxes):
+    progress = True
+    while progress:
+        progress = False
+
+        # naked singles: cells with only one candidate left
+        for i in range(81):
+            if grid[i]:
+                continue
+            r, c, b = ROW_OF[i], COL_OF[i], BOX_OF[i]
+            candidates = ALL & ~(rows[r] | cols[c] | boxes[b])
+            if not candidates:
+                return False
+            if not candidates & (candidates - 1):
+                grid[i] = DIGIT[candidates]
+                rows[r] |= candidates
+                cols[c] |= candidates
+                boxes[b] |= candidates
+                progress = True
+
+        # hidden singles: digits with only one place left in a unit
+        for unit in UNITS:
+            once = twice = placed = 0
+            for i in unit:
+                if grid[i]:
+                    placed |= BIT[grid[i]]
+                    continue
+                candidates = ALL & ~(rows[ROW_OF[i]] | cols[COL_OF[i]] | boxes[BOX_OF[i]])
+                twice |= once & candidates
+                once |= candidates
+            if once | placed != ALL:
+                return False
+            hidden = once & ~twice
+            if not hidden:
+                continue
+            for i in unit:
+                if grid[i]:
+                    continue
+                r, c, b = ROW_OF[i], COL_OF[i], BOX_OF[i]
+                bit = hidden & ~(rows[r] | cols[c] | boxes[b])
+                if not bit:
+                    continue
+                if bit & (bit - 1):
+                    return False
+                grid[i] = DIGIT[bit]
+                rows[r] |= bit
+                cols[c] |= bit
+                boxes[b] |= bit
+                progress = True
+    return True
+
+
+# depth-first search that always branches on the most constrained cell,
+# yields every solution of the given state
+def _search(grid, rows, cols, boxes):
+    if not _propagate(grid, rows, cols, boxes):
+        if stats.enabled:
+            stats.count('backtracks')
+        return
+
+    best, best_candidates, best_count = -1, 0, 10
+    for i in range(81):
+        if grid[i]:
+            continue
+        candidates = ALL & ~(rows[ROW_OF[i]] | cols[COL_OF[i]] | boxes[BOX_OF[i]])
+        if COUNT[candidates] < best_count:
+            best, best_candidates, best_count = i, candidates, COUNT[candidates]
+            if best_count == 2:
+                break
+
+    if best < 0:
+        yield grid
+        return
+
+    r, c, b = ROW_OF[best], COL_OF[best], BOX_OF[best]
+    while best_candidates:
+        bit = best_candidates & -best_candidates
+        best_candidates ^= bit
+        branch = grid[:]
+        branch[best] = DIGIT[bit]
+        branch_rows, branch_cols, branch_boxes = rows[:], cols[:], boxes[:]
+        branch_rows[r] |= bit
+        branch_cols[c] |= bit
+        branch_boxes[b] |= bit
+        yield from _search(branch, branch_rows, branch_cols, branch_boxes)
+
+
+# yields every solution of a flat 81-int grid (0 for empty cells)
+def solutions(grid):
+    state = _state(grid)
+    if state is not None:
+        yield from _search(*state)
+
+
+# counts the solutions of a board, stopping as soon as the limit is reached.
+# with the default limit of 2 this answers "none, unique or ambiguous"
+def count_solutions(board, limit=2):
+    if stats.enabled:
+        stats.count('uniqueness_checks')
+    count = 0
+    for _ in solutions(board.grid):
+        count += 1
+        if count == limit:
+            break
+    return count
+
+
 class Solver:
 
     # constructor for a solver, keeps a local copy of provided board
@@ -8,36 +139,19 @@ class Solver:
     # checks to make sure each compartment contains
     def is_valid(self):
         valid = set(range(1, 10))
-        for i, box in self.board.boxes.items():
-            if set([x.value for x in box]) != valid:
-                return False
-        for i, row in self.board.rows.items():
-            if set([x.value for x in row]) != valid:
-                return False
-        for i, col in self.board.columns.items():
-            if set([x.value for x in col]) != valid:
+        grid = self.board.grid
+        for unit in UNITS:
+            if set(grid[i] for i in unit) != valid:
                 return False
         return True
 
-    # solves a puzzle by moving forward and backwards through puzzle
-    # and testing values
+    # solves the puzzle with the bitmask engine and writes the first
+    # solution found back into the local board
     def solve(self):
-        index = 0
-        while -1 < index < len(self.vacants):
-            current = self.vacants[index]
-            flag = False
-            my_range = range(current.value + 1, 10)
-            for x in my_range:
-                if x in self.board.get_possibles(current):
-                    current.value = x
-                    flag = True
-                    break
-            if not flag:
-                current.value = 0
-                index -= 1
-            else:
-                index += 1
-        if len(self.vacants) == 0:
+        if stats.enabled:
+            stats.count('solver_calls')
+        solution = next(solutions(self.board.grid), None)
+        if solution is None:
             return False
-        else:
-            return index == len(self.vacants)
+        self.board.load(solution)
+        return True
@@ -0,0 +1,69 @@
+import time
+from collections import defaultdict
+
+# Instrumentation is off unless something (e.g. main.py --profile) turns it
+# on. Hot paths check `stats.enabled` before recording anything, so the
+# cost when it's off is a single attribute lookup.
+enabled = False
+
+# the label counters and timers are currently recorded under; the generator
+# sets it to the difficulty it's working on
+scope = 'Book'
+
+counters = defaultdict(int)
+timings = defaultdict(float)
+
+
+def count(name, n=1):
+    counters[scope, name] += n
+
+
+class timer:
+
+    # accumulates the wall-clock time spent inside a `with` block
+    def __init__(self, name, scope=None):
+        self.name = name
+        self.scope = scope
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            timings[self.scope or scope, self.name] += time.perf_counter() - self.start
+
+
+# removes and returns everything recorded so far, e.g. to send it back from
+# a worker process
+def drain():
+    recorded = (dict(counters), dict(timings))
+    counters.clear()
+    timings.clear()
+    return recorded
+
+
+# adds counters and timings drained elsewhere
+def merge(recorded):
+    drained_counters, drained_timings = recorded
+    for key, value in drained_counters.items():
+        counters[key] += value
+    for key, value in drained_timings.items():
+        timings[key] += value
+
+
+# a per-scope summary of everything recorded
+def report():
+    scopes = sorted({s for s, _ in counters} | {s for s, _ in timings})
+    lines = []
+    for s in scopes:
+        lines.append(f'{s}:')
+        for (key_scope, name), value in sorted(counters.items()):
+            if key_scope == s:
+                lines.append(f'  {name:<24} {value:>12}')
+        for (key_scope, name), value in sorted(timings.items()):
+            if key_scope == s:
+                lines.append(f'  {name + " (s)":<24} {value:>12.3f}')
+    return '\n'.join(lines)
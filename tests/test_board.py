@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from sudoku.board import Board
+from sudoku.generator import _random_line_order
+
+# a valid solved grid, so swaps and permutations keep it a sudoku
+SOLVED = [(r * 3 + r // 3 + c) % 9 + 1 for r in range(9) for c in range(9)]
+
+
+# the incrementally tracked state of a board
+def tracked(board):
+    return bytes(board.counts), list(board.masks), bytes(board.filled), bytes(board.segments)
+
+
+def assert_matches_recount(board):
+    assert tracked(board) == tracked(Board(board.grid))
+
+
+# one random change to the board; returns the board to keep working on
+def random_step(board, rng):
+    step = rng.randrange(8)
+    if step == 0:
+        # any digit, clashes included, so duplicate counts are exercised
+        board.set(rng.randrange(81), rng.randrange(1, 10))
+    elif step == 1:
+        board.set(rng.randrange(81), 0)
+    elif step == 2:
+        band = rng.randrange(3)
+        board.swap_row(band * 3 + rng.randrange(3), band * 3 + rng.randrange(3))
+    elif step == 3:
+        stack = rng.randrange(3)
+        board.swap_column(stack * 3 + rng.randrange(3), stack * 3 + rng.randrange(3))
+    elif step == 4:
+        board.swap_band(rng.randrange(3), rng.randrange(3))
+    elif step == 5:
+        board.swap_stack(rng.randrange(3), rng.randrange(3))
+    elif step == 6:
+        board.permute(
+            rows=_random_line_order(rng),
+            cols=_random_line_order(rng),
+            transpose=rng.random() < 0.5,
+            digits=[0] + rng.sample(range(1, 10), 9),
+        )
+    else:
+        copy = board.copy()
+        # changing the copy must leave the original's state alone
+        copy.set(rng.randrange(81), rng.randrange(10))
+        assert_matches_recount(board)
+        board = copy
+    return board
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_incremental_state_matches_recount(seed):
+    rng = random.Random(seed)
+    board = Board(SOLVED)
+    assert_matches_recount(board)
+    for _ in range(200):
+        board = random_step(board, rng)
+        assert_matches_recount(board)
+
+
+def test_load_recounts():
+    board = Board(SOLVED)
+    board.set(0, 0)
+    board.load(bytes(81))
+    assert tracked(board) == tracked(Board())
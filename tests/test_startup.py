@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules only rendering and flattening need
+RENDER_MODULES = ('fpdf', 'pdf2image', 'PIL')
+
+# seconds a fresh interpreter may take to import main.py, as in the benchmarks
+IMPORT_BUDGET = 0.25
+
+
+# runs main.py with the given arguments (none: only imports it) in a fresh
+# interpreter, and returns how long the import took and which modules
+# ended up loaded
+def run_main(*argv):
+    code = (
+        'import json, sys, time\n'
+        'start = time.perf_counter()\n'
+        'import main\n'
+        'elapsed = time.perf_counter() - start\n'
+        f'sys.argv = ["main.py", *{list(argv)!r}]\n'
+        'if len(sys.argv) > 1:\n'
+        '    main.run(main.SudokuArgumentParser().parse_args())\n'
+        'print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))\n'
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_import_is_light_and_fast():
+    result = run_main()
+    assert not set(RENDER_MODULES) & set(result['modules'])
+    assert result['elapsed'] < IMPORT_BUDGET
+
+
+# a small puzzle file written by the generate command, with that run's result
+@pytest.fixture(scope='module')
+def generated(tmp_path_factory):
+    path = tmp_path_factory.mktemp('puzzles') / 'puzzles.txt'
+    return path, run_main('generate', str(path), '--count', '8', '--seed', '1')
+
+
+def test_generate_skips_render_modules(generated):
+    path, result = generated
+    assert len(path.read_text().splitlines()) == 8
+    assert not set(RENDER_MODULES) & set(result['modules'])
+
+
+def test_validate_skips_render_modules(generated):
+    path, _ = generated
+    result = run_main('validate', str(path))
+    assert not set(RENDER_MODULES) & set(result['modules'])
@@ -1,20 +1,185 @@
+import os
 import subprocess
-from pdf2image import convert_from_path
+import sys
+import tempfile
+from itertools import islice
+from exceptions import FontNotEmbeddedError
+
+# pypdf, pdf2image and Pillow are imported by the functions using them, so
+# that importing utils stays cheap for commands that never flatten
+
+# the ways flatten_pdf can flatten a PDF
+FLATTEN_BACKENDS = ('vector', 'raster')
+
+# document and page entries that make a PDF interactive
+INTERACTIVE_KEYS = ('/AcroForm', '/OpenAction', '/AA', '/Names', '/Outlines')
 
 
 def batched(iterable, batch_size):
-    i = 0
-    while i < len(iterable):
-        yield iterable[i: i + batch_size]
-        i += batch_size
+    iterator = iter(iterable)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
 
 
 def copy_to_clipboard(data):
     subprocess.run("pbcopy", text=True, input=data)
 
 
-def flatten_pdf(input_pdf_path, output_pdf_path, dpi=400, resolution=400.0):
-    images = convert_from_path(input_pdf_path, dpi=dpi)
-    im1 = images[0]
-    images.pop(0)
-    im1.save(output_pdf_path, "PDF", resolution=resolution, save_all=True, append_images=images)
+# writes a flattened, print-ready copy of the PDF. The vector backend keeps
+# the pages as they are drawn and falls back to the raster one if a page
+# uses a font that isn't embedded
+def flatten_pdf(input_pdf_path, output_pdf_path, dpi=400, resolution=400.0, chunk_size=10, thread_count=1,
+                backend='vector'):
+    flattener = Flattener(output_pdf_path, dpi, resolution, chunk_size, thread_count, backend)
+    flattener.add(input_pdf_path)
+    flattener.close()
+
+
+class Flattener:
+
+    # flattens PDFs one after another into a single output, e.g. the parts
+    # of a pipelined build. Vector pages are gathered in one PdfWriter and
+    # written out once by close(), so each part is only read once. Once a
+    # part has to be rasterized, the pages gathered so far are written and
+    # that part and every later one are rasterized and appended
+    def __init__(self, output_pdf_path, dpi=400, resolution=400.0, chunk_size=10, thread_count=1,
+                 backend='vector'):
+        self.output_pdf_path = output_pdf_path
+        self.raster_args = (dpi, resolution, chunk_size, thread_count)
+        self.backend = backend
+        self.writer = None
+        self.written = False
+
+    def add(self, input_pdf_path):
+        if self.backend == 'vector':
+            from pypdf import PdfWriter
+
+            try:
+                self.writer = self.writer or PdfWriter()
+                return copy_vector_pages(input_pdf_path, self.writer)
+            except FontNotEmbeddedError as e:
+                print(f'{e} Rasterizing instead.', file=sys.stderr)
+            self.backend = 'raster'
+            self.write_vector_pages()
+        rasterize_pdf(input_pdf_path, self.output_pdf_path, *self.raster_args, append=self.written)
+        self.written = True
+
+    def write_vector_pages(self):
+        if self.writer is not None and len(self.writer.pages):
+            write_vector_pdf(self.writer, self.output_pdf_path)
+            self.written = True
+        self.writer = None
+
+    def close(self):
+        self.write_vector_pages()
+
+
+# copies the PDF's pages into a PdfWriter without rasterizing them, so they
+# keep their vector drawing and the font subsets fpdf embeds, and drops
+# their annotations. Nothing is copied if any page uses a font that isn't
+# embedded
+def copy_vector_pages(input_pdf_path, writer):
+    from pypdf import PdfReader
+
+    reader = PdfReader(input_pdf_path)
+    for number, page in enumerate(reader.pages, 1):
+        missing = unembedded_fonts(page.get('/Resources'))
+        if missing:
+            raise FontNotEmbeddedError(f'Page {number} uses fonts that are not embedded: {", ".join(missing)}.')
+    for page in reader.pages:
+        page = writer.add_page(page)
+        for key in ('/Annots', '/AA'):
+            page.pop(key, None)
+
+
+# writes the pages gathered in a PdfWriter, without forms, scripts or
+# anything else interactive
+def write_vector_pdf(writer, output_pdf_path):
+    for key in INTERACTIVE_KEYS:
+        writer.root_object.pop(key, None)
+    writer.compress_identical_objects()
+    with open(output_pdf_path, 'wb') as f:
+        writer.write(f)
+
+
+# joins PDFs, e.g. the parts of a pipelined build, into one as they are,
+# without drawing or flattening anything again
+def concatenate_pdfs(input_pdf_paths, output_pdf_path):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for path in input_pdf_paths:
+        writer.append(path)
+    writer.compress_identical_objects()
+    with open(output_pdf_path, 'wb') as f:
+        writer.write(f)
+
+
+# copies the PDF's pages without rasterizing them
+def vectorize_pdf(input_pdf_path, output_pdf_path):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    copy_vector_pages(input_pdf_path, writer)
+    write_vector_pdf(writer, output_pdf_path)
+
+
+# names of the fonts used in a resource dictionary, or in the form
+# XObjects it holds, whose glyphs aren't embedded in the file
+def unembedded_fonts(resources):
+    if resources is None:
+        return []
+    resources = resources.get_object()
+    missing = []
+    for font in resources.get('/Font', {}).values():
+        font = font.get_object()
+        if font.get('/Subtype') == '/Type3':
+            continue  # glyphs are drawn by the PDF itself
+        if font.get('/Subtype') == '/Type0':
+            descriptor = font['/DescendantFonts'][0].get_object().get('/FontDescriptor')
+        else:
+            descriptor = font.get('/FontDescriptor')
+        descriptor = descriptor.get_object() if descriptor is not None else {}
+        if not any(key in descriptor for key in ('/FontFile', '/FontFile2', '/FontFile3')):
+            missing.append(str(font.get('/BaseFont')))
+    for xobject in resources.get('/XObject', {}).values():
+        xobject = xobject.get_object()
+        if xobject.get('/Subtype') == '/Form':
+            missing.extend(unembedded_fonts(xobject.get('/Resources')))
+    return missing
+
+
+# rasterizes the PDF a chunk of pages at a time and appends each chunk to the
+# output, so only chunk_size pages are ever held in memory at once. Pages are
+# rendered to a temporary folder by thread_count poppler processes. With
+# append set, the pages are added to an output flattened earlier
+def rasterize_pdf(input_pdf_path, output_pdf_path, dpi=400, resolution=400.0, chunk_size=10, thread_count=1,
+                  append=False):
+    from pdf2image import convert_from_path, pdfinfo_from_path
+
+    page_count = pdfinfo_from_path(input_pdf_path)['Pages']
+    with tempfile.TemporaryDirectory() as output_folder:
+        for first_page in range(1, page_count + 1, chunk_size):
+            last_page = min(first_page + chunk_size - 1, page_count)
+            paths = convert_from_path(
+                input_pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                thread_count=thread_count, output_folder=output_folder, paths_only=True,
+            )
+            append_pages(output_pdf_path, paths, resolution, append=append or first_page > 1)
+            for path in paths:
+                os.remove(path)
+
+
+# writes the page images to a PDF, or appends them to one written earlier
+def append_pages(output_pdf_path, paths, resolution=400.0, append=False):
+    from PIL import Image
+
+    images = [Image.open(path) for path in paths]
+    try:
+        images[0].save(output_pdf_path, "PDF", resolution=resolution, save_all=True,
+                       append=append, append_images=images[1:])
+    finally:
+        for image in images:
+            image.close()